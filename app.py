@@ -6,13 +6,17 @@
 # ===============================================================
 
 from __future__ import annotations
-import os, re, json, socket, ipaddress, logging, ssl
+import os, re, json, math, socket, ipaddress, logging, ssl, errno, select, selectors, threading, time
 from datetime import datetime, date, timedelta
 from pathlib import Path
 from flask import (
     Flask, render_template, request, jsonify, Response, g, send_from_directory
 )
-import dns.resolver, dns.reversename
+import dns.reversename
+import dns_engine
+from mta_sts import is_timeout  # DNS, socket and requests timeouts
+from queue_logging import setup_logging, parse_sample_rates
+import api_encoding
 
 # ===============================================================
 # Basic config
@@ -21,14 +25,51 @@ LANGS = {"zh", "en"}
 DEFAULT_LANG = "en"
 SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret")
 
-# Global flag: whether client IP is in China (computed per request)
-IS_CHINA_IP = False
+# Returning visitors carry their resolved language here (skips GeoIP)
+LANG_COOKIE = "lang"
+LANG_COOKIE_MAX_AGE = 30 * 24 * 3600
+
+# Endpoints that never need language/geo resolution
+ASSET_ENDPOINTS = {"static", "favicon", "robots", "sitemap"}
+
+# Per-request time budget (s); keep it below the proxy / gunicorn timeout.
+# Clients may ask for less via X-Request-Timeout or JSON "timeout".
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "25"))
+MIN_REQUEST_DEADLINE = 0.5
+
+# JSON serializer: "auto" (orjson when installed), "orjson" or "std"
+JSON_PROVIDER = os.getenv("JSON_PROVIDER", "auto").lower()
+# Bodies smaller than this (bytes) go out uncompressed
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", str(api_encoding.COMPRESS_MIN_SIZE)))
+
+# ===============================================================
+# Logging: bounded queue + background writer, never blocks a request.
+# LOG_SAMPLE thins high-volume lines, e.g. "request=0.1,geoip_error=0.2"
+# ===============================================================
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+    sample_rates=parse_sample_rates(os.getenv("LOG_SAMPLE")),
+)
+log = logging.getLogger("dovecot_io")
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
 app.config.update(
     SECRET_KEY=SECRET_KEY,
     MAX_CONTENT_LENGTH=16 * 1024 * 1024,  # 16MB upload limit
 )
+app.json = api_encoding.pick_json_provider(None if JSON_PROVIDER == "auto" else JSON_PROVIDER)(app)
+
+# ===============================================================
+# Response compression (registered first, so it runs after every
+# other after_request hook and sees the final body)
+# ===============================================================
+@app.after_request
+def compress_response(response):
+    """gzip/br by Accept-Encoding; skips streams, files and tiny bodies."""
+    return api_encoding.compress_response(
+        response, request.accept_encodings, request.method, COMPRESS_MIN_SIZE
+    )
 
 # ===============================================================
 # Security headers
@@ -52,23 +93,35 @@ def sanitize_path_param(value: str) -> str:
     return re.sub(r"[^a-zA-Z0-9_-]", "", value or "")
 
 # ===============================================================
-# China IP detector (optional; cached)
+# China IP detector (optional; cached; geoip2 loaded on first lookup
+# or by preload() in the gunicorn master)
 # ===============================================================
 _ip_checker = None
+_ip_checker_tried = False
+_ip_checker_lock = threading.Lock()
 _ip_cache: dict[str, tuple[bool, datetime]] = {}
 _cache_expiry = timedelta(hours=1)
 
 def init_ip_checker():
     """Initialize optional China-IP checker with a local GeoLite2 DB."""
-    global _ip_checker
+    global _ip_checker, _ip_checker_tried
+    _ip_checker_tried = True
     try:
         from china_ip_checker import ChinaIPChecker
         _ip_checker = ChinaIPChecker(db_path="GeoLite2-Country.mmdb")
-        logging.info("✅ ChinaIPChecker initialized")
+        log.info("✅ ChinaIPChecker initialized")
     except Exception as e:
-        logging.info(f"⚠️ ChinaIPChecker init failed: {e}")
+        log.info("⚠️ ChinaIPChecker init failed: %s", e)
         _ip_checker = None
 
+def get_ip_checker():
+    """The checker, initialized once on first use (None if unavailable)."""
+    if not _ip_checker_tried:
+        with _ip_checker_lock:
+            if not _ip_checker_tried:
+                init_ip_checker()
+    return _ip_checker
+
 
 def is_china_ip(ip_address: str) -> bool:
     """Return True if IP is in China (cached if possible)."""
@@ -78,9 +131,10 @@ def is_china_ip(ip_address: str) -> bool:
         if now - ts < _cache_expiry:
             return result
 
-    if _ip_checker:
+    checker = get_ip_checker()
+    if checker:
         try:
-            info = _ip_checker.check_single(ip_address)
+            info = checker.check_single(ip_address)
             is_cn = info.get("is_china", False) and not info.get("error")
             _ip_cache[ip_address] = (is_cn, now)
             return is_cn
@@ -91,60 +145,118 @@ def is_china_ip(ip_address: str) -> bool:
     return False
 
 # ===============================================================
-# Request hooks: detect IP -> decide language -> maintenance gate
+# Request-scoped client IP & language (lazy: resolved on first use)
 # ===============================================================
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    force=True
-)
-
-@app.before_request
-def detect_ip_and_language():
+def is_asset_request() -> bool:
+    """Static files, favicon, robots.txt, sitemap: no language needed."""
+    return request.endpoint in ASSET_ENDPOINTS or request.path.startswith(app.static_url_path + "/")
+
+def client_ips() -> tuple[str, list[str]]:
+    """Client IP + full chain from X-Forwarded-For/remote_addr (cached on g)."""
+    if "client_ip" not in g:
+        xff = request.headers.get("X-Forwarded-For", "")
+        remote = request.remote_addr or ""
+        ips = [ip.strip() for ip in (xff + "," + remote).split(",") if ip.strip()]
+        g.client_ip, g.all_ips = (ips[0] if ips else "unknown"), ips
+    return g.client_ip, g.all_ips
+
+def lang_hint() -> str | None:
     """
-    Decide client language via IP:
-    - China IP => zh
-    - Otherwise => en
+    Cheap hints that short-circuit the GeoIP lookup:
+    - lang cookie from a previous visit
+    - Accept-Language whose top preference is Chinese
     """
-    global IS_CHINA_IP
-    xff = request.headers.get("X-Forwarded-For", "")
-    remote = request.remote_addr or ""
-    ips = [ip.strip() for ip in (xff + "," + remote).split(",") if ip.strip()]
-    client_ip = ips[0] if ips else "unknown"
-
-    IS_CHINA_IP =  is_china_ip(client_ip)
-    g.client_ip, g.all_ips = client_ip, ips
-    g.lang = "zh" if IS_CHINA_IP else "en"
-    logging.info(f"[IP] {client_ip} | CN={IS_CHINA_IP} | LANG={g.lang}")
+    cookie = request.cookies.get(LANG_COOKIE)
+    if cookie in LANGS:
+        return cookie
+    best = request.accept_languages.best or ""
+    if best.lower().split("-")[0] == "zh":
+        return "zh"
+    return None
+
+def resolve_lang() -> str:
+    """
+    Decide client language:
+    - cookie / Accept-Language hint if present
+    - otherwise via IP: China IP => zh, else en
+    """
+    hint = lang_hint()
+    if hint:
+        g.lang_source = "hint"
+        return hint
+    client_ip, _ = client_ips()
+    g.is_china_ip = is_china_ip(client_ip)
+    g.lang_source = "geo"
+    lang = "zh" if g.is_china_ip else "en"
+    log.info("[IP]", extra={
+        "sample": "request",
+        "fields": {"ip": client_ip, "cn": g.is_china_ip, "lang": lang, "path": request.path},
+    })
+    return lang
 
+def current_lang() -> str:
+    """Return language for this request (resolved lazily, once)."""
+    if is_asset_request():
+        return DEFAULT_LANG
+    if "lang" not in g:
+        g.lang = resolve_lang()
+    return g.lang
 
+@app.after_request
+def remember_lang(response):
+    """
+    Persist a GeoIP-resolved language so the next visit skips the lookup,
+    and tell shared caches the body depends on the language inputs.
+    """
+    if "lang" in g:
+        response.vary.update(("Cookie", "Accept-Language"))
+    if g.get("lang_source") == "geo":
+        response.set_cookie(
+            LANG_COOKIE, g.lang, max_age=LANG_COOKIE_MAX_AGE,
+            httponly=True, samesite="Lax", secure=request.is_secure,
+        )
+    return response
 
 @app.after_request
 def add_debug_ip_headers(response):
-    """Expose client IP info in headers for debugging."""
-    if hasattr(g, "client_ip"):
-        response.headers["X-Client-IP"] = g.client_ip
-    if hasattr(g, "all_ips"):
-        response.headers["X-All-IPs"] = ",".join(g.all_ips)
+    """Expose client IP info in headers for debugging (not on assets)."""
+    if is_asset_request():
+        return response
+    client_ip, all_ips = client_ips()
+    response.headers["X-Client-IP"] = client_ip
+    response.headers["X-All-IPs"] = ",".join(all_ips)
     return response
 
 # ===============================================================
 # i18n helpers
 # ===============================================================
+_i18n_bundles: dict[tuple[str, str], dict] = {}
+_i18n_year = 0
+
+def build_i18n_bundles() -> None:
+    """
+    Load every i18n/<lang>/<name>.json once, with {year} substituted.
+    Rebuilt automatically when the year rolls over.
+    """
+    global _i18n_bundles, _i18n_year
+    year = datetime.now().year
+    bundles = {}
+    for path in Path("i18n").glob("*/*.json"):
+        data = json.loads(path.read_text(encoding="utf-8"))
+        for k, v in list(data.items()):
+            if isinstance(v, str):
+                data[k] = v.replace("{year}", str(year))
+        bundles[(path.parent.name, path.stem)] = data
+    _i18n_bundles, _i18n_year = bundles, year
+
 def load_i18n(lang: str, name: str) -> dict:
     """
-    Load i18n/<lang>/<name>.json.
+    Return the i18n/<lang>/<name>.json bundle (shared: do not mutate).
     If missing, return {}.
     """
-    path = Path(f"i18n/{lang}/{name}.json")
-    if not path.exists():
-        return {}
-    data = json.load(path.open(encoding="utf-8"))
-    # Simple runtime token replacement
-    for k, v in list(data.items()):
-        if isinstance(v, str):
-            data[k] = v.replace("{year}", str(datetime.now().year))
-    return data
+    if _i18n_year != datetime.now().year:
+        build_i18n_bundles()
+    return _i18n_bundles.get((lang, name), {})
 
 @app.context_processor
 def inject_template_helpers():
@@ -156,10 +268,6 @@ def is_mobile_request() -> bool:
     ua = (request.headers.get("User-Agent") or "").lower()
     return any(x in ua for x in ["iphone", "android", "ipad", "mobile"])
 
-def current_lang() -> str:
-    """Return language for this request."""
-    return getattr(g, "lang", DEFAULT_LANG)
-
 def common_context(lang: str | None = None) -> dict:
     """
     Common context for templates. Language auto-resolved if not provided.
@@ -252,105 +360,372 @@ def not_found(_):
     t = load_i18n(lang, "404")
     return render_template("404.html", t=t, lang=lang), 404
 
+# ===============================================================
+# Per-request deadline: every DNS lifetime, connect timeout and TLS
+# handshake gets what is left of it; work stops once it is spent or
+# the client has gone away.
+# ===============================================================
+class DeadlineExceeded(TimeoutError):
+    """The request's time budget ran out, or the client disconnected."""
+
+def request_deadline() -> float:
+    """
+    Monotonic deadline for this request, fixed on first use:
+    - X-Request-Timeout header or JSON "timeout" (seconds), if given
+    - clamped to [MIN_REQUEST_DEADLINE, REQUEST_DEADLINE]; unparsable
+      values (and NaN) are ignored
+    """
+    if "deadline" not in g:
+        budget = REQUEST_DEADLINE
+        hint = request.headers.get("X-Request-Timeout")
+        if hint is None and request.is_json:
+            body = request.get_json(silent=True)
+            hint = body.get("timeout") if isinstance(body, dict) else None
+        try:
+            value = float(hint)
+        except (TypeError, ValueError):
+            value = math.nan
+        if not math.isnan(value):
+            budget = min(budget, max(MIN_REQUEST_DEADLINE, value))
+        g.deadline = time.monotonic() + budget
+    return g.deadline
+
+def client_gone() -> bool:
+    """Best-effort disconnect check on gunicorn's raw client socket."""
+    if g.get("client_gone"):
+        return True
+    sock = request.environ.get("gunicorn.socket")
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        gone = bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        gone = True
+    g.client_gone = gone
+    return gone
+
+def remaining(cap: float | None = None) -> float:
+    """Seconds left in the budget (optionally capped); raises once it is spent."""
+    left = request_deadline() - time.monotonic()
+    if left <= 0 or client_gone():
+        raise DeadlineExceeded(tr_api(current_lang(), "请求超时", "request deadline exceeded"))
+    return left if cap is None else min(cap, left)
+
+def error_payload(e: Exception) -> dict:
+    """Error response body; timeouts carry an explicit "timeout": true marker."""
+    body = {"ok": False, "error": str(e)}
+    if is_timeout(e):
+        body["timeout"] = True
+    return body
+
 # ===============================================================
 # Email diagnostics API (localized responses)
 # ===============================================================
+def dns_one(qname, rdtype):
+    """Single query within the request budget."""
+    return dns_engine.resolve(qname, rdtype, remaining(), client_gone)
+
+def dns_batch(questions: list) -> list:
+    """Batch of queries within the request budget; items are Answers or exceptions."""
+    return dns_engine.resolve_many(questions, remaining(), client_gone)
+
+def resolve_mx(domain: str) -> list[dict]:
+    """MX records as [{"host", "pref"}] (shared by /api/mx and MTA-STS)."""
+    answers = dns_one(domain, "MX")
+    return [{"host": str(r.exchange).rstrip("."), "pref": int(r.preference)} for r in answers]
+
+def resolve_ipv4(target: str) -> str:
+    """IPv4 literal as-is, otherwise the first A record."""
+    try:
+        return str(ipaddress.IPv4Address(target))
+    except ValueError:
+        return str(dns_one(target, "A")[0])
+
+HOSTS_FILE = "/etc/hosts"
+_hosts_table: tuple[float, dict[str, list[str]]] = (0.0, {})
+
+def hosts_file_addresses(name: str) -> list[str]:
+    """Addresses for name in /etc/hosts (re-read when the file changes)."""
+    global _hosts_table
+    try:
+        mtime = os.stat(HOSTS_FILE).st_mtime
+    except OSError:
+        return []
+    if mtime != _hosts_table[0]:
+        table: dict[str, list[str]] = {}
+        with open(HOSTS_FILE, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                fields = line.split("#", 1)[0].split()
+                try:
+                    ip = str(ipaddress.ip_address(fields[0].split("%")[0])) if len(fields) > 1 else None
+                except ValueError:
+                    ip = None
+                for host in fields[1:] if ip else ():
+                    table.setdefault(host.lower().rstrip("."), []).append(ip)
+        _hosts_table = (mtime, table)
+    return _hosts_table[1].get(name.lower().rstrip("."), [])
+
+def resolve_host(target: str) -> list[str]:
+    """
+    Addresses to try, in order: an IP literal as-is, /etc/hosts entries,
+    otherwise A then AAAA records (queried together within the budget).
+    """
+    try:
+        return [str(ipaddress.ip_address(target))]
+    except ValueError:
+        pass
+    addresses = hosts_file_addresses(target)
+    if addresses:
+        return addresses
+    answers = dns_batch([(target, "A"), (target, "AAAA")])
+    addresses = [str(r) for ans in answers if not isinstance(ans, Exception) for r in ans]
+    if addresses:
+        return addresses
+    # Prefer reporting a timeout over a (possibly premature) "no records"
+    raise next((a for a in answers if is_timeout(a)), answers[0])
+
+def connect_host(addresses: list[str], port: int, cap: float) -> socket.socket:
+    """Connect to the first address that accepts; each try gets remaining(cap)."""
+    error: OSError | None = None
+    for ip in addresses:
+        timeout = remaining(cap)
+        try:
+            return socket.create_connection((ip, port), timeout=timeout)
+        except OSError as e:
+            error = e
+    raise error
+
+# ===============================================================
+# SPF include/redirect expansion (RFC 7208 §4.6.4: max 10 DNS lookups)
+# ===============================================================
+SPF_LOOKUP_LIMIT = 10
+SPF_MAX_DEPTH = 10
+
+def spf_terms(record: str) -> tuple[int, list[str]]:
+    """(DNS-querying terms in one record, domains pulled in via include/redirect)."""
+    count, targets = 0, []
+    for term in record.split()[1:]:
+        term = term.lstrip("+-~?").lower()
+        if term.startswith(("include:", "redirect=")):
+            count += 1
+            target = term[8:] if term.startswith("include:") else term[9:]
+            if "%" not in target:  # macros can't be expanded without a sender
+                targets.append(target)
+        elif term in ("a", "mx", "ptr") or term.startswith(("a:", "a/", "mx:", "mx/", "ptr:", "exists:")):
+            count += 1
+    return count, targets
+
+def expand_spf(record: str) -> tuple[int, list[str], bool]:
+    """
+    Walk the include/redirect tree level by level; each level is one
+    batch of TXT queries. Returns (total DNS lookups, problems found,
+    complete) where complete is False if the request budget ran out.
+    """
+    total, frontier, seen, problems = 0, [record], set(), []
+    for _ in range(SPF_MAX_DEPTH):
+        targets = []
+        for rec in frontier:
+            count, found = spf_terms(rec)
+            total += count
+            targets += [t for t in found if t not in seen]
+            seen.update(found)
+        if not targets or total > SPF_LOOKUP_LIMIT:
+            break
+        try:
+            answers = dns_batch([(t, "TXT") for t in targets])
+        except DeadlineExceeded:
+            return total, problems, False
+        frontier = []
+        for target, ans in zip(targets, answers):
+            if is_timeout(ans):
+                return total, problems, False
+            if isinstance(ans, Exception):
+                problems.append(f"{target}: {ans}")
+                continue
+            spf = next((t for t in (str(r).strip('"') for r in ans) if t.startswith("v=spf1")), None)
+            if spf:
+                frontier.append(spf)
+            else:
+                problems.append(f"{target}: no SPF record")
+    return total, problems, True
+
 @app.post("/api/mx")
 def api_mx():
     """DNS MX lookup."""
-    lang = current_lang()
     domain = request.json.get("target", "").strip()
     if not domain:
-        return jsonify({"ok": False, "error": tr_api(lang, "缺少目标域名", "Missing target domain")})
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "缺少目标域名", "Missing target domain")})
     try:
-        answers = dns.resolver.resolve(domain, "MX")
-        data = [{"host": str(r.exchange).rstrip("."), "pref": int(r.preference)} for r in answers]
-        return jsonify({"ok": True, "data": data})
+        return jsonify({"ok": True, "data": resolve_mx(domain)})
     except Exception as e:
-        return jsonify({"ok": False, "error": str(e)})
+        return jsonify(error_payload(e))
 
 @app.post("/api/spf")
 def api_spf():
     """SPF record parsing."""
-    lang = current_lang()
     domain = request.json.get("target", "").strip()
     if not domain:
-        return jsonify({"ok": False, "error": tr_api(lang, "缺少目标域名", "Missing target domain")})
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "缺少目标域名", "Missing target domain")})
     try:
-        txts = [str(r).strip('"') for r in dns.resolver.resolve(domain, "TXT")]
+        txts = [str(r).strip('"') for r in dns_one(domain, "TXT")]
         spf = next((t for t in txts if t.startswith("v=spf1")), None)
         if not spf:
-            raise Exception(tr_api(lang, "未找到 SPF 记录", "SPF record not found"))
+            raise Exception(tr_api(current_lang(), "未找到 SPF 记录", "SPF record not found"))
         includes = spf.count("include:")
         policy = "-all" if "-all" in spf else "~all" if "~all" in spf else "?all"
+        lookups, problems, complete = expand_spf(spf)
         issues = [
-            tr_api(lang, f"include 链 {includes}", f"include chain {includes}"),
-            tr_api(lang, f"策略: {policy}", f"policy: {policy}")
+            tr_api(current_lang(), f"include 链 {includes}", f"include chain {includes}"),
+            tr_api(current_lang(), f"策略: {policy}", f"policy: {policy}"),
+            tr_api(current_lang(), f"DNS 查询次数 {lookups}/{SPF_LOOKUP_LIMIT}",
+                   f"DNS lookups {lookups}/{SPF_LOOKUP_LIMIT}"),
         ]
-        return jsonify({"ok": True, "data": spf, "issues": issues})
+        if lookups > SPF_LOOKUP_LIMIT:
+            issues.append(tr_api(current_lang(), "超过 10 次查询上限 (permerror)", "exceeds 10-lookup limit (permerror)"))
+        issues += problems
+        body = {"ok": True, "data": spf, "issues": issues}
+        if not complete:
+            issues.append(tr_api(current_lang(), "include 展开超时，结果不完整", "include expansion timed out (partial)"))
+            body["timeout"] = True
+        return jsonify(body)
     except Exception as e:
-        return jsonify({"ok": False, "error": str(e)})
+        return jsonify(error_payload(e))
+
+# Selectors tried when the client sends "selectors": "auto"
+COMMON_DKIM_SELECTORS = (
+    "default", "dkim", "mail", "email", "smtp", "selector1", "selector2",
+    "google", "k1", "k2", "k3", "s1", "s2", "key1", "key2", "mx", "dk",
+    "mandrill", "mailjet", "sendgrid", "zoho", "protonmail", "fm1", "fm2", "fm3",
+)
+MAX_DKIM_SELECTORS = 50           # per request; each one is a DNS query
 
 @app.post("/api/dkim")
 def api_dkim():
     """Fetch DKIM public key(s) for given selector(s)."""
-    lang = current_lang()
     data = request.get_json(force=True) or {}
     domain = (data.get("target") or "").strip()
     selectors = data.get("selectors", ["default"])
+    if selectors == "auto":
+        selectors = COMMON_DKIM_SELECTORS
+    elif isinstance(selectors, str):
+        selectors = [selectors]
     if not domain:
-        return jsonify({"ok": False, "error": tr_api(lang, "缺少目标域名", "Missing target domain")})
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "缺少目标域名", "Missing target domain")})
+    if not isinstance(selectors, (list, tuple)) or not all(isinstance(s, str) and s for s in selectors):
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "selectors 必须是字符串列表", "selectors must be a list of strings")})
+    if len(selectors) > MAX_DKIM_SELECTORS:
+        return jsonify({"ok": False, "error": tr_api(
+            current_lang(), f"selector 过多（最多 {MAX_DKIM_SELECTORS} 个）",
+            f"Too many selectors (at most {MAX_DKIM_SELECTORS})")})
     results = []
-    for s in selectors:
-        name = f"{s}._domainkey.{domain}"
-        try:
-            txts = [str(r).strip('"') for r in dns.resolver.resolve(name, "TXT")]
-            results.append({"selector": s, "pubkey": txts})
-        except Exception as e:
-            results.append({"selector": s, "error": str(e)})
+    try:
+        answers = dns_batch([(f"{s}._domainkey.{domain}", "TXT") for s in selectors])
+    except DeadlineExceeded as e:
+        return jsonify(error_payload(e))
+    for s, ans in zip(selectors, answers):
+        if isinstance(ans, Exception):
+            item = {"selector": s, "error": str(ans)}
+            if is_timeout(ans):
+                item["timeout"] = True
+            results.append(item)
+        else:
+            results.append({"selector": s, "pubkey": [str(r).strip('"') for r in ans]})
     return jsonify({"ok": True, "data": results})
 
 @app.post("/api/dmarc")
 def api_dmarc():
     """DMARC record lookup."""
-    lang = current_lang()
     domain = request.json.get("target", "").strip()
     if not domain:
-        return jsonify({"ok": False, "error": tr_api(lang, "缺少目标域名", "Missing target domain")})
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "缺少目标域名", "Missing target domain")})
     try:
         name = f"_dmarc.{domain}"
-        txts = [str(r).strip('"') for r in dns.resolver.resolve(name, "TXT")]
+        txts = [str(r).strip('"') for r in dns_one(name, "TXT")]
         return jsonify({"ok": True, "data": txts[0]})
     except Exception as e:
-        return jsonify({"ok": False, "error": str(e)})
+        return jsonify(error_payload(e))
+
+MAIL_PORTS = [25, 465, 587, 143, 993, 110, 995]
+PORT_TIMEOUT = 2
+TLS_CONNECT_TIMEOUT = 3
+TLS_HANDSHAKE_TIMEOUT = 3
+
+def probe_ports(ip: str, ports: list[int], timeout: float) -> dict[int, dict]:
+    """
+    Non-blocking connect to every port at once; wait at most timeout in
+    total. Ports still pending at the end are marked "timeout": true.
+    """
+    family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+    sel = selectors.DefaultSelector()
+    results: dict[int, dict] = {}
+    try:
+        for p in ports:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            err = sock.connect_ex((ip, p))
+            if err in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                sel.register(sock, selectors.EVENT_WRITE, p)
+                continue
+            results[p] = {"reachable": True} if err == 0 else {"reachable": False, "note": os.strerror(err)}
+            sock.close()
+        end = time.monotonic() + timeout
+        while sel.get_map():
+            left = end - time.monotonic()
+            if left <= 0 or client_gone():
+                break
+            for key, _ in sel.select(min(left, 0.25)):
+                err = key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                results[key.data] = {"reachable": True} if err == 0 else {"reachable": False, "note": os.strerror(err)}
+                sel.unregister(key.fileobj)
+                key.fileobj.close()
+    finally:
+        for key in list(sel.get_map().values()):
+            results[key.data] = {"reachable": False, "note": "timed out", "timeout": True}
+            sel.unregister(key.fileobj)
+            key.fileobj.close()
+        sel.close()
+    return results
 
 @app.post("/api/ports")
 def api_ports():
-    """Connectivity checks for common mail ports."""
-    lang = current_lang()
+    """Connectivity checks for common mail ports (probed in parallel)."""
     host = (request.json.get("host") or request.json.get("target") or "").strip()
     if not host:
-        return jsonify({"ok": False, "error": tr_api(lang, "缺少目标主机或域名", "Missing target host or domain")})
-    ports = [25, 465, 587, 143, 993, 110, 995]
-    res = []
-    for p in ports:
-        try:
-            with socket.create_connection((host, p), timeout=2):
-                res.append({"service": f"{p}", "reachable": True})
-        except Exception as e:
-            res.append({"service": f"{p}", "reachable": False, "note": str(e)})
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "缺少目标主机或域名", "Missing target host or domain")})
+    try:
+        results: dict[int, dict] = {}
+        pending = MAIL_PORTS
+        # Ports unreachable on one address are retried on the next
+        for ip in resolve_host(host):
+            try:
+                budget = remaining(PORT_TIMEOUT)
+            except DeadlineExceeded:
+                if results:
+                    break
+                raise
+            for p, r in probe_ports(ip, pending, budget).items():
+                if r["reachable"] or p not in results:
+                    results[p] = r
+            pending = [p for p in pending if not results[p]["reachable"]]
+            if not pending:
+                break
+    except Exception as e:
+        return jsonify(error_payload(e))
+    res = [{"service": f"{p}", **results[p]} for p in MAIL_PORTS]
     return jsonify({"ok": True, "data": res})
 
 @app.post("/api/tls")
 def api_tls():
     """Basic TLS check on SMTPS(465)."""
-    lang = current_lang()
     domain = request.json.get("target", "").strip()
     if not domain:
-        return jsonify({"ok": False, "error": tr_api(lang, "缺少目标域名", "Missing target domain")})
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "缺少目标域名", "Missing target domain")})
     try:
         ctx = ssl.create_default_context()
-        with socket.create_connection((domain, 465), timeout=3) as sock:
+        with connect_host(resolve_host(domain), 465, TLS_CONNECT_TIMEOUT) as sock:
+            # Handshake gets its own slice of what is left
+            sock.settimeout(remaining(TLS_HANDSHAKE_TIMEOUT))
             with ctx.wrap_socket(sock, server_hostname=domain) as ssock:
                 cert = ssock.getpeercert() or {}
                 # Extract CN from subject
@@ -371,17 +746,16 @@ def api_tls():
                 }
                 return jsonify({"ok": True, "data": data})
     except Exception as e:
-        return jsonify({"ok": False, "error": str(e)})
+        return jsonify(error_payload(e))
 
 @app.post("/api/dnsbl")
 def api_dnsbl():
     """Query a few DNSBLs for listing status."""
-    lang = current_lang()
     domain = request.json.get("target", "").strip()
     if not domain:
-        return jsonify({"ok": False, "error": tr_api(lang, "缺少目标域名", "Missing target domain")})
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "缺少目标域名", "Missing target domain")})
     try:
-        ip = socket.gethostbyname(domain)
+        ip = resolve_ipv4(domain)
         rev_ip = ".".join(reversed(ip.split(".")))
         bls = [
             "zen.spamhaus.org",
@@ -389,35 +763,129 @@ def api_dnsbl():
             "dnsbl.sorbs.net",
             "b.barracudacentral.org",
         ]
-        listed = 0
-        for bl in bls:
-            try:
-                dns.resolver.resolve(f"{rev_ip}.{bl}", "A")
-                listed += 1
-            except Exception:
-                pass
-        return jsonify({"ok": True, "data": {"checked": len(bls), "listed": listed}})
+        answers = dns_batch([(f"{rev_ip}.{bl}", "A") for bl in bls])
+        zones = []
+        for bl, ans in zip(bls, answers):
+            if is_timeout(ans):
+                zones.append({"zone": bl, "listed": False, "timeout": True})
+            else:
+                zones.append({"zone": bl, "listed": not isinstance(ans, Exception)})
+        listed = sum(1 for z in zones if z["listed"])
+        return jsonify({"ok": True, "data": {"checked": len(bls), "listed": listed, "zones": zones}})
     except Exception as e:
-        return jsonify({"ok": False, "error": str(e)})
+        return jsonify(error_payload(e))
 
 @app.post("/api/ptr")
 def api_ptr():
     """Reverse PTR lookup for target's A record."""
-    lang = current_lang()
     domain = request.json.get("target", "").strip()
     if not domain:
-        return jsonify({"ok": False, "error": tr_api(lang, "缺少目标域名", "Missing target domain")})
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "缺少目标域名", "Missing target domain")})
     try:
-        ip = socket.gethostbyname(domain)
+        ip = resolve_ipv4(domain)
         rev = dns.reversename.from_address(ip)
-        ptr = str(dns.resolver.resolve(rev, "PTR")[0]).rstrip(".")
+        ptr = str(dns_one(rev, "PTR")[0]).rstrip(".")
         return jsonify({"ok": True, "data": {"ip": ip, "ptr": ptr}})
+    except Exception as e:
+        return jsonify(error_payload(e))
+
+@app.post("/api/mtasts")
+def api_mtasts():
+    """MTA-STS (record + HTTPS policy vs. MX), TLS-RPT and BIMI records."""
+    domain = request.json.get("target", "").strip()
+    if not domain:
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "缺少目标域名", "Missing target domain")})
+    import mta_sts
+    try:
+        data = mta_sts.check_domain(domain, resolve_mx, deadline=request_deadline(), abort=client_gone)
+    except Exception as e:
+        return jsonify(error_payload(e))
+    return jsonify({"ok": True, "data": data})
+
+# ===============================================================
+# Domain monitoring: one shared monitor process under gunicorn
+# (started from gunicorn.conf.py), in-process for the dev server.
+# Changing or removing a watch needs the token returned on creation.
+# ===============================================================
+MONITOR_OPTIONS = {
+    "workers": int(os.getenv("MONITOR_WORKERS", "8")),
+    "max_domains": int(os.getenv("MONITOR_MAX_DOMAINS", "50000")),
+    "max_per_client": int(os.getenv("MONITOR_MAX_PER_CLIENT", "20")),
+}
+
+def start_monitor_service(inherited=()) -> None:
+    """
+    Start the shared monitor process; call in the master before workers
+    fork. inherited: the master's listening sockets (closed in the service).
+    """
+    import monitor
+    monitor.start_service(inherited, **MONITOR_OPTIONS)
+
+def monitor_call(method: str, *args):
+    """Call the shared monitor (a proxy under gunicorn, reconnected after a restart)."""
+    import monitor
+    return monitor.call(method, *args, **MONITOR_OPTIONS)
+
+@app.post("/api/monitor")
+def api_monitor():
+    """Watch a domain; checks are re-run in the background when records expire."""
+    domain = request.json.get("target", "").strip().lower().rstrip(".")
+    if not domain:
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "缺少目标域名", "Missing target domain")})
+    from monitor import ClientLimitError
+    try:
+        data = monitor_call("watch", domain, request.json.get("checks"), request.json.get("token"), client_ips()[0])
+        return jsonify({"ok": True, "data": data})
+    except ClientLimitError:
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "该客户端的监控数量已达上限", "Too many watches registered from this address")})
+    except OverflowError:
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "监控列表已满", "Watch list is full")})
+    except PermissionError:
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "该域名已在监控中，修改需提供 token", "Domain is already being watched; changing it needs its token")})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)})
 
+@app.post("/api/monitor/changes")
+def api_monitor_changes():
+    """Changes recorded for a watched domain since it was registered."""
+    domain = request.json.get("target", "").strip().lower().rstrip(".")
+    try:
+        status = monitor_call("status", domain) if domain else None
+    except Exception as e:
+        return jsonify(error_payload(e))
+    if status is None:
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "该域名未在监控中", "Domain is not being watched")})
+    return jsonify({"ok": True, "data": status})
+
+@app.post("/api/monitor/remove")
+def api_monitor_remove():
+    """Stop watching a domain (requires the token returned by /api/monitor)."""
+    domain = request.json.get("target", "").strip().lower().rstrip(".")
+    try:
+        removed = monitor_call("unwatch", domain, request.json.get("token"))
+    except PermissionError:
+        return jsonify({"ok": False, "error": tr_api(current_lang(), "token 无效或缺失", "Invalid or missing token")})
+    except Exception as e:
+        return jsonify(error_payload(e))
+    return jsonify({"ok": True, "data": {"removed": removed}})
+
 # ================== 启动 ==================
-with app.app_context():
-    init_ip_checker()
+def preload() -> None:
+    """
+    Build read-only state once in the gunicorn master (preload_app, see
+    gunicorn.conf.py) so forked workers share it copy-on-write:
+    GeoIP reader, i18n bundles, compiled templates, deferred imports.
+    """
+    import gc
+    get_ip_checker()
+    build_i18n_bundles()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    # Deferred in normal imports; load them here so workers inherit them
+    import requests, monitor  # noqa: F401
+    # Keep the collector from touching (and so copying) inherited objects
+    gc.collect()
+    gc.freeze()
 
 # ===============================================================
 # Entrypoint
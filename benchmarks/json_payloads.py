@@ -0,0 +1,133 @@
+# ===============================================================
+# benchmarks/json_payloads.py — API serialization & wire size
+# Description: Times stdlib vs orjson providers on payloads shaped like
+#              the real handler responses and reports bytes on the wire
+#              (per provider: orjson writes non-ASCII as raw UTF-8).
+# Usage: python benchmarks/json_payloads.py [--number 2000]
+# ===============================================================
+
+from __future__ import annotations
+import argparse, base64, os, sys, time, timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+
+import dns.rdata
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+import api_encoding, app, monitor, mta_sts
+
+
+def txt(text: str) -> str:
+    """A TXT rdata as the handlers render it: str(rdata).strip('"') (255-byte strings)."""
+    chunks = " ".join('"%s"' % text[i:i + 255] for i in range(0, len(text), 255))
+    return str(dns.rdata.from_text("IN", "TXT", chunks)).strip('"')
+
+
+def dkim_payload() -> dict:
+    """/api/dkim with "selectors": "auto"; a few selectors hold 2048-bit keys."""
+    results = []
+    for i, s in enumerate(app.COMMON_DKIM_SELECTORS):
+        if i % 6 == 0:
+            key = base64.b64encode(os.urandom(294)).decode()  # 2048-bit RSA SPKI size
+            results.append({"selector": s, "pubkey": [txt(f"v=DKIM1; k=rsa; p={key}")]})
+        else:
+            name = f"{s}._domainkey.example.com."
+            results.append({"selector": s, "error": f"The DNS query name does not exist: {name}"})
+    return {"ok": True, "data": results}
+
+
+def dnsbl_payload() -> dict:
+    """/api/dnsbl: not listed anywhere."""
+    zones = [{"zone": z, "listed": False} for z in monitor.DNSBL_ZONES]
+    return {"ok": True, "data": {"checked": len(zones), "listed": 0, "zones": zones}}
+
+
+def spf_payload(lang: str) -> dict:
+    """/api/spf; the zh variant carries the localized issue strings."""
+    spf = "v=spf1 include:_spf.google.com include:spf.protection.outlook.com ip4:192.0.2.0/24 -all"
+    issues = {
+        "en": ["include chain 2", "policy: -all", "DNS lookups 6/10"],
+        "zh": ["include 链 2", "策略: -all", "DNS 查询次数 6/10"],
+    }[lang]
+    return {"ok": True, "data": spf, "issues": issues}
+
+
+def mtasts_payload() -> dict:
+    """/api/mtasts, built with mta_sts' own helpers."""
+    record = "v=STSv1; id=20250101T000000"
+    policy = mta_sts.parse_policy(
+        "version: STSv1\nmode: enforce\nmx: mx1.example.com\nmx: *.mail.example.com\nmax_age: 604800\n"
+    )
+    rua = "v=TLSRPTv1; rua=mailto:tls@example.com"
+    return {"ok": True, "data": {
+        "mta_sts": {"record": record, "id": "20250101T000000", "policy": policy, "cached": True,
+                    "mx_check": [{"host": h, "matched": any(mta_sts.mx_matches(p, h) for p in policy["mx"])}
+                                 for h in ("mx1.example.com", "a.mail.example.com")]},
+        "tls_rpt": {"record": rua, "tags": mta_sts.parse_tags(rua)},
+        "bimi": {"error": "no v=BIMI1 record"},
+    }}
+
+
+def monitor_payload() -> dict:
+    """/api/monitor/changes for a watch with 50 recorded MX changes."""
+    w = monitor.Watch("example.com", list(monitor.CHECKS), max_changes=50)
+    now = time.time()
+    for c in w.checks:
+        w.last_run[c] = now
+    for i in range(50):
+        w.changes.append({"check": "mx", "at": f"2025-01-01T00:{i:02d}:00",
+                          **monitor.diff([f"10 mx{i}.example.com"], [f"10 mx{i + 1}.example.com"])})
+    return {"ok": True, "data": w.to_dict()}
+
+
+PAYLOADS = {
+    "dkim (auto)": dkim_payload(),
+    "dnsbl": dnsbl_payload(),
+    "spf (en)": spf_payload("en"),
+    "spf (zh)": spf_payload("zh"),
+    "mtasts": mtasts_payload(),
+    "monitor changes": monitor_payload(),
+}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--number", type=int, default=2000)
+    args = ap.parse_args()
+
+    flask_app = Flask(__name__)
+    providers = {"std": DefaultJSONProvider(flask_app)}
+    if api_encoding.orjson is not None:
+        providers["orjson"] = api_encoding.OrjsonProvider(flask_app)
+    encodings = api_encoding.available_encodings()
+
+    print(f"Serialization (jsonify body, µs per call, {args.number} calls):")
+    print(f"  {'payload':<16}" + "".join(f"{n:>10}" for n in providers))
+    with flask_app.app_context():
+        for name, obj in PAYLOADS.items():
+            row = f"  {name:<16}"
+            for prov in providers.values():
+                secs = timeit.timeit(lambda: prov.response(obj).get_data(), number=args.number)
+                row += f"{secs / args.number * 1e6:10.1f}"
+            print(row)
+
+        print("\nBytes on the wire:")
+        print(f"  {'payload':<16}{'provider':>9}{'raw':>8}" + "".join(f"{e:>8}" for e in encodings)
+              + f"{'gzip µs':>10}")
+        for name, obj in PAYLOADS.items():
+            for pname, prov in providers.items():
+                data = prov.response(obj).get_data()
+                row = f"  {name:<16}{pname:>9}{len(data):8d}"
+                for enc in encodings:
+                    row += f"{len(api_encoding.compress(data, enc)):8d}"
+                n = max(1, args.number // 10)
+                secs = timeit.timeit(lambda: api_encoding.compress(data, "gzip"), number=n)
+                print(row + f"{secs / n * 1e6:10.1f}")
+    print(f"\n(bodies under {api_encoding.COMPRESS_MIN_SIZE} bytes are sent uncompressed)")
+
+
+if __name__ == "__main__":
+    main()
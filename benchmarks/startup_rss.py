@@ -0,0 +1,105 @@
+# ===============================================================
+# benchmarks/startup_rss.py — Startup time & per-worker memory
+# Description: Compares "each worker imports app" with "master preloads,
+#              workers fork" (gunicorn preload_app). Linux only (/proc).
+# Usage: python benchmarks/startup_rss.py [--workers 4] [--runs 5]
+# ===============================================================
+
+from __future__ import annotations
+import argparse, json, os, statistics, subprocess, sys, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def import_time(code: str, runs: int) -> float:
+    """Median wall time (ms) of a fresh interpreter running code."""
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def memory_kb() -> dict[str, int]:
+    """Rss / Pss / Private_* from /proc/self/smaps_rollup (kB)."""
+    out = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                out[key] = int(rest.split()[0])
+    return out
+
+
+def serve_a_little():
+    """Touch the same paths a real worker would."""
+    import app
+    client = app.app.test_client()
+    for path in ("/", "/terms", "/privacy", "/robots.txt", "/nope"):
+        client.get(path)
+
+
+def fork_workers(n: int, import_in_child: bool) -> list[dict[str, int]]:
+    """Fork n children; each serves a few pages and reports its memory."""
+    pipes, pids = [], []
+    for _ in range(n):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            if import_in_child:
+                import app  # noqa: F401
+            serve_a_little()
+            os.write(w, json.dumps(memory_kb()).encode())
+            os._exit(0)
+        os.close(w)
+        pipes.append(r)
+        pids.append(pid)
+    results = []
+    for r, pid in zip(pipes, pids):
+        with os.fdopen(r) as f:
+            results.append(json.loads(f.read()))
+        os.waitpid(pid, 0)
+    return results
+
+
+def child_mode(mode: str, workers: int) -> None:
+    """Runs in a clean interpreter so the two modes don't share state."""
+    os.chdir(ROOT)
+    sys.path.insert(0, str(ROOT))
+    if mode == "preload":
+        import app
+        app.preload()
+        stats = fork_workers(workers, import_in_child=False)
+    else:
+        stats = fork_workers(workers, import_in_child=True)
+    for key in ("Rss", "Pss", "Private_Dirty"):
+        vals = [s.get(key, 0) for s in stats]
+        print(f"  {key:<14} per worker: {statistics.mean(vals) / 1024:7.1f} MiB")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--mode", choices=["preload", "per-worker"], help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.mode:
+        child_mode(args.mode, args.workers)
+        return
+
+    print("Startup (median of %d fresh interpreters):" % args.runs)
+    print(f"  import app          : {import_time('import app', args.runs):7.1f} ms")
+    print(f"  import app+preload(): {import_time('import app; app.preload()', args.runs):7.1f} ms")
+    for mode in ("per-worker", "preload"):
+        print(f"\nMemory, {args.workers} workers, mode={mode}:")
+        subprocess.run([sys.executable, __file__, "--mode", mode, "--workers", str(args.workers)],
+                       cwd=ROOT, check=True, stderr=subprocess.DEVNULL)
+
+
+if __name__ == "__main__":
+    main()
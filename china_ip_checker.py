@@ -20,7 +20,8 @@ class ChinaIPChecker:
         'db_path': 'GeoLite2-Country.mmdb',
         'max_workers': 20,
         'cache_size': 10000,
-        'timeout': 30
+        'timeout': 30,
+        'mode': geoip2.database.MODE_AUTO
     }
 
     def __init__(self, **kwargs):
@@ -32,6 +33,7 @@ class ChinaIPChecker:
             max_workers: 最大并发数
             cache_size: 缓存大小
             timeout: 查询超时时间
+            mode: maxminddb 打开模式（默认 MODE_AUTO，优先 mmap）
         """
         self.config = {**self.DEFAULT_CONFIG, **kwargs}
 
@@ -42,6 +44,10 @@ class ChinaIPChecker:
         self.db_path = self.config['db_path']
         self._lock = threading.Lock()
 
+        # Reader 只打开一次：索引在 master 进程构建后，fork 出的 worker
+        # 以写时复制方式共享（mmap 模式下文件页也由页缓存共享）
+        self._reader = geoip2.database.Reader(self.db_path, mode=self.config['mode'])
+
         # 初始化缓存查询方法
         self._cached_query = lru_cache(maxsize=self.config['cache_size'])(self._query_database)
 
@@ -50,13 +56,15 @@ class ChinaIPChecker:
     def _query_database(self, ip: str) -> tuple:
         """内部数据库查询方法"""
         try:
-            with geoip2.database.Reader(self.db_path) as reader:
-                response = reader.country(ip)
-                return (response.country.iso_code, None)
+            response = self._reader.country(ip)
+            return (response.country.iso_code, None)
         except geoip2.errors.AddressNotFoundError:
             return (None, 'IP地址未找到')
         except Exception as e:
-            logger.warning(f"查询IP {ip} 时出错: {str(e)}")
+            # 每次查询失败都会触发，走结构化字段 + 采样（LOG_SAMPLE=geoip_error=...）
+            logger.warning("查询IP时出错", extra={
+                'sample': 'geoip_error', 'fields': {'ip': ip, 'error': str(e)}
+            })
             return (None, str(e))
 
     def _is_china_ip_single(self, ip: str) -> Dict[str, Union[str, bool]]:
@@ -85,7 +93,9 @@ class ChinaIPChecker:
 
         except Exception as e:
             result['error'] = f"查询异常: {str(e)}"
-            logger.error(f"查询IP {ip} 异常: {str(e)}")
+            logger.error("查询IP异常", extra={
+                'sample': 'geoip_error', 'fields': {'ip': ip, 'error': str(e)}
+            })
 
         return result
 
@@ -222,6 +232,10 @@ class ChinaIPChecker:
         """清除查询缓存"""
         self._cached_query.cache_clear()
 
+    def close(self):
+        """关闭数据库 Reader"""
+        self._reader.close()
+
     def get_cache_info(self) -> Dict[str, int]:
         """获取缓存信息"""
         info = self._cached_query.cache_info()
@@ -242,7 +256,11 @@ class ChinaIPChecker:
         if not os.path.exists(new_db_path):
             raise FileNotFoundError(f"新数据库文件不存在: {new_db_path}")
 
-        self.db_path = new_db_path
+        with self._lock:
+            old_reader = self._reader
+            self._reader = geoip2.database.Reader(new_db_path, mode=self.config['mode'])
+            self.db_path = new_db_path
+        old_reader.close()
         self.clear_cache()
         logger.info(f"数据库已更新为: {new_db_path}")
 
@@ -381,6 +399,7 @@ class ChinaIPCheckerContext:
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.checker:
             self.checker.clear_cache()
+            self.checker.close()
 
 
 # 装饰器
@@ -0,0 +1,582 @@
+# ===============================================================
+# dns_engine.py — Multiplexed DNS query engine
+# Description: Many outstanding queries over a small, regularly rotated
+#              pool of UDP sockets (answers matched by query ID and
+#              nameserver address/port), per-query retry with backoff,
+#              reusable pipelined TCP on truncation, de-duplication of
+#              identical outstanding questions and a cap on queries in
+#              flight (the rest wait their turn).
+# License: MIT
+# ===============================================================
+
+from __future__ import annotations
+import errno, heapq, ipaddress, itertools, logging, os, random, selectors, socket, struct, threading, time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError, wait
+from typing import Callable, Iterable
+import dns.exception, dns.flags, dns.message, dns.name, dns.rcode
+import dns.rdataclass, dns.rdatatype, dns.resolver
+
+DEFAULT_LIFETIME = 5.0        # total budget per query (s), like dnspython
+ATTEMPT_TIMEOUT = 0.8         # first attempt; doubles on every retry
+MAX_ATTEMPTS = 4
+UDP_SOCKETS = 4               # per address family
+UDP_ROTATE_QUERIES = 1000     # replace a UDP socket (new source port) after this many queries...
+UDP_ROTATE_SECONDS = 60.0     # ...or once it is this old, so spoofers can't learn the ports
+EDNS_PAYLOAD = 1232           # avoids fragmentation; larger answers come via TCP
+TCP_IDLE = 30.0               # close idle TCP connections after (s)
+ABORT_POLL = 0.25             # how often gather() asks abort() (s)
+MAX_INFLIGHT = 256            # distinct queries on the wire at once
+
+Question = tuple[str, str]    # (qname, rdtype), e.g. ("example.com", "MX")
+
+log = logging.getLogger(__name__)
+
+
+class _Query:
+    """One outstanding question, shared by every caller that asked it."""
+
+    __slots__ = ("key", "qname", "rdtype", "msg", "wire", "qid", "waiters",
+                 "started", "deadline", "attempt", "ns_index", "tcp", "sock_index", "errors", "done")
+
+    def __init__(self, key, qname, rdtype, deadline):
+        self.key = key
+        self.qname = qname
+        self.rdtype = rdtype
+        self.msg = dns.message.make_query(qname, rdtype, use_edns=0, payload=EDNS_PAYLOAD)
+        self.wire = self.msg.to_wire()
+        self.qid = self.msg.id
+        self.waiters: list[Future] = []
+        self.started = time.monotonic()
+        self.deadline = deadline
+        self.attempt = 0
+        self.ns_index = random.randrange(1 << 16)
+        self.tcp = False
+        self.sock_index = -1
+        self.errors: list = []
+        self.done = False
+
+    def set_qid(self, qid: int) -> None:
+        self.qid = qid
+        self.msg.id = qid
+        self.wire = struct.pack("!H", qid) + self.wire[2:]
+
+
+class _UDPSocket:
+    """Pool member; retired ones stay open until their queries finish."""
+
+    __slots__ = ("index", "sock", "opened", "sent", "users", "retired")
+
+    def __init__(self, index: int, family: int):
+        self.index = index
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.opened = time.monotonic()
+        self.sent = 0
+        self.users = 0       # queries waiting for an answer on this socket
+        self.retired = False
+
+    def worn_out(self, now: float) -> bool:
+        return self.sent >= UDP_ROTATE_QUERIES or now - self.opened >= UDP_ROTATE_SECONDS
+
+
+class _TCPConn:
+    """Pipelined TCP connection to one nameserver (RFC 7766)."""
+
+    def __init__(self, addr: tuple[str, int], family: int):
+        self.addr = addr
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        self.connected = False
+        self.outbuf = bytearray()
+        self.inbuf = bytearray()
+        self.pending: dict[int, _Query] = {}
+        self.last_used = time.monotonic()
+
+
+class DNSEngine:
+    """
+    All socket I/O happens on one background thread; callers get
+    concurrent.futures.Future objects resolving to dns.resolver.Answer
+    (or raising NXDOMAIN / NoAnswer / NoNameservers / LifetimeTimeout,
+    like dns.resolver.resolve()). At most max_inflight distinct queries
+    are outstanding; further questions queue (in order) until one finishes.
+    """
+
+    def __init__(self, nameservers: list[str] | None = None, port: int = 53,
+                 udp_sockets: int = UDP_SOCKETS, attempt_timeout: float = ATTEMPT_TIMEOUT,
+                 max_attempts: int = MAX_ATTEMPTS, lifetime: float = DEFAULT_LIFETIME,
+                 max_inflight: int = MAX_INFLIGHT):
+        if nameservers is None:
+            nameservers = dns.resolver.get_default_resolver().nameservers
+        # Canonical text form, as recvfrom() reports the source address
+        self.nameservers = [_canonical_ip(str(ns)) for ns in nameservers if _is_ip(str(ns))]
+        if not self.nameservers:
+            raise dns.resolver.NoResolverConfiguration("no usable nameservers")
+        self.port = port
+        self.udp_sockets = udp_sockets
+        self.attempt_timeout = attempt_timeout
+        self.max_attempts = max_attempts
+        self.lifetime = lifetime
+        self.max_inflight = max_inflight
+        self.pid = os.getpid()
+
+        self._lock = threading.Lock()
+        self._inbox: list[tuple] = []
+        self._thread: threading.Thread | None = None
+        self._sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._sel.register(self._wake_r, selectors.EVENT_READ, ("wake", None))
+
+        self._udp: dict[int, _UDPSocket] = {}
+        self._udp_by_family: dict[int, list[int]] = {}  # active (not retired) per family
+        self._udp_index = itertools.count()
+        self._by_id: dict[tuple[int, int], _Query] = {}
+        self._inflight: dict[tuple[str, int], _Query] = {}
+        self._waiting: deque[tuple] = deque()  # submits beyond max_inflight
+        self._tcp: dict[tuple[str, int], _TCPConn] = {}
+        self._timers: list[tuple[float, int, _Query, int]] = []
+        self._seq = itertools.count()
+
+    # ---------- public API ----------
+    def submit(self, qname, rdtype, lifetime: float | None = None) -> Future:
+        """Queue one question; identical outstanding questions share a query."""
+        fut: Future = Future()
+        deadline = time.monotonic() + (self.lifetime if lifetime is None else lifetime)
+        self._post(("submit", (qname, rdtype, fut, deadline)))
+        return fut
+
+    def submit_many(self, questions: Iterable[Question], lifetime: float | None = None) -> list[Future]:
+        return [self.submit(qname, rdtype, lifetime) for qname, rdtype in questions]
+
+    def resolve_many(self, questions: Iterable[Question], lifetime: float | None = None,
+                     abort: Callable[[], bool] | None = None) -> list:
+        """Submit a batch and wait for all of it; each item is an Answer or an exception."""
+        lifetime = self.lifetime if lifetime is None else lifetime
+        futures = self.submit_many(questions, lifetime)
+        return gather(futures, lifetime, abort)
+
+    def resolve(self, qname, rdtype, lifetime: float | None = None,
+                abort: Callable[[], bool] | None = None) -> dns.resolver.Answer:
+        """Drop-in for dns.resolver.resolve(qname, rdtype)."""
+        result = self.resolve_many([(qname, rdtype)], lifetime, abort)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    # ---------- caller side ----------
+    def _post(self, item: tuple) -> None:
+        with self._lock:
+            self._inbox.append(item)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="dns-engine", daemon=True)
+                self._thread.start()
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, InterruptedError):
+            pass  # already signalled
+
+    # ---------- I/O thread ----------
+    def _run(self) -> None:
+        try:
+            while True:
+                try:
+                    self._run_once()
+                except Exception:
+                    # A bug must not take the only I/O thread down with it
+                    log.exception("dns engine loop error")
+                    time.sleep(0.01)
+        finally:
+            with self._lock:
+                self._thread = None  # restarted by the next _post()
+
+    def _run_once(self) -> None:
+        timeout = None
+        if self._timers:
+            timeout = max(0.0, self._timers[0][0] - time.monotonic())
+        for key, mask in self._sel.select(timeout):
+            kind, obj = key.data
+            if kind == "wake":
+                self._drain_inbox()
+            elif kind == "udp":
+                self._read_udp(obj)
+            elif kind == "tcp":
+                self._service_tcp(obj, mask)
+        self._fire_timers()
+        self._admit()
+        self._close_idle_tcp()
+
+    def _guarded(self, q: _Query, fn: Callable, *args) -> None:
+        """Run fn(*args) for q; an unexpected error fails q instead of the loop."""
+        try:
+            fn(*args)
+        except Exception as e:
+            log.exception("dns engine error", extra={"fields": {"qname": q.key[0], "rdtype": q.key[1]}})
+            if not q.done:
+                self._finish(q, exc=e)
+
+    def _drain_inbox(self) -> None:
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        with self._lock:
+            items, self._inbox = self._inbox, []
+        for op, payload in items:
+            if op == "submit":
+                self._waiting.append(payload)
+            elif op == "cancel":
+                self._prune(payload)
+
+    def _admit(self) -> None:
+        """Start waiting questions while fewer than max_inflight queries are out."""
+        now = time.monotonic()
+        while self._waiting and len(self._inflight) < self.max_inflight:
+            qname, rdtype, fut, deadline = self._waiting.popleft()
+            if fut.done():
+                continue  # cancelled while waiting
+            if now >= deadline:
+                _settle(fut, exc=dns.resolver.LifetimeTimeout(timeout=0.0, errors=[]))
+                continue
+            self._start(qname, rdtype, fut, deadline)
+
+    def _start(self, qname, rdtype, fut: Future, deadline: float) -> None:
+        try:
+            name = qname if isinstance(qname, dns.name.Name) else dns.name.from_text(qname)
+            rdtype = dns.rdatatype.RdataType.make(rdtype)
+        except Exception as e:
+            _settle(fut, exc=e)
+            return
+        key = (name.to_text().lower(), int(rdtype))
+        q = self._inflight.get(key)
+        if q is None:
+            q = self._inflight[key] = _Query(key, name, rdtype, deadline)
+            q.waiters.append(fut)
+            self._guarded(q, self._send, q)
+        else:
+            q.waiters.append(fut)
+            q.deadline = max(q.deadline, deadline)
+        fut.add_done_callback(lambda f, q=q: f.cancelled() and self._post(("cancel", q)))
+
+    def _prune(self, q: _Query) -> None:
+        """Drop a query once every caller waiting on it has cancelled."""
+        q.waiters = [w for w in q.waiters if not w.done()]
+        if not q.waiters and not q.done:
+            self._forget(q)
+
+    def _nameserver(self, q: _Query) -> str:
+        return self.nameservers[q.ns_index % len(self.nameservers)]
+
+    def _send(self, q: _Query) -> None:
+        now = time.monotonic()
+        ns = self._nameserver(q)
+        try:
+            if q.tcp:
+                self._send_tcp(q, ns)
+            else:
+                self._send_udp(q, ns)
+        except OSError as e:
+            q.errors.append((ns, q.tcp, self.port, e, None))
+        # Exponential backoff, never past the query's deadline
+        wait_for = min(self.attempt_timeout * (2 ** q.attempt), max(0.0, q.deadline - now))
+        heapq.heappush(self._timers, (now + wait_for, next(self._seq), q, q.attempt))
+
+    def _send_udp(self, q: _Query, ns: str) -> None:
+        family = _family(ns)
+        if family not in self._udp_by_family:
+            self._udp_by_family[family] = [self._open_udp(family) for _ in range(self.udp_sockets)]
+        if q.sock_index < 0:
+            active = self._udp_by_family[family]
+            slot = random.randrange(len(active))
+            u = self._udp[active[slot]]
+            if u.worn_out(time.monotonic()):
+                self._retire_udp(u)
+                u = self._udp[self._open_udp(family)]
+                active[slot] = u.index
+            q.sock_index = u.index
+            while (q.sock_index, q.qid) in self._by_id:
+                q.set_qid(random.randrange(1 << 16))
+            self._by_id[(q.sock_index, q.qid)] = q
+            u.users += 1
+            u.sent += 1
+        self._udp[q.sock_index].sock.sendto(q.wire, (ns, self.port))
+
+    def _open_udp(self, family: int) -> int:
+        u = _UDPSocket(next(self._udp_index), family)
+        self._udp[u.index] = u
+        self._sel.register(u.sock, selectors.EVENT_READ, ("udp", u.index))
+        return u.index
+
+    def _retire_udp(self, u: _UDPSocket) -> None:
+        """Take u out of the pool; it closes once its last query is done."""
+        u.retired = True
+        if not u.users:
+            del self._udp[u.index]
+            self._sel.unregister(u.sock)
+            u.sock.close()
+
+    def _unbind(self, q: _Query) -> None:
+        """Stop matching UDP answers for q (its ID on its socket)."""
+        if self._by_id.pop((q.sock_index, q.qid), None) is q:
+            u = self._udp[q.sock_index]
+            u.users -= 1
+            if u.retired:
+                self._retire_udp(u)
+        q.sock_index = -1
+
+    def _read_udp(self, idx: int) -> None:
+        u = self._udp.get(idx)
+        while u is not None and self._udp.get(idx) is u:  # closed when its last query finishes (retired)
+            try:
+                data, addr = u.sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                continue  # e.g. ICMP port unreachable surfaced on the socket
+            if len(data) < 12 or addr[0] not in self.nameservers or addr[1] != self.port:
+                continue
+            q = self._by_id.get((idx, struct.unpack("!H", data[:2])[0]))
+            if q is None:
+                continue
+            response = self._parse(q, data)
+            if response is None:
+                continue
+            if response.flags & dns.flags.TC:
+                # Truncated: move this question to TCP as a new attempt, so
+                # the UDP attempt's timer no longer applies
+                self._unbind(q)
+                q.tcp = True
+                q.attempt += 1
+                self._guarded(q, self._send, q)
+                continue
+            self._guarded(q, self._handle_response, q, response, addr[0])
+
+    def _send_tcp(self, q: _Query, ns: str) -> None:
+        addr = (ns, self.port)
+        conn = self._tcp.get(addr)
+        if conn is None:
+            conn = self._tcp[addr] = _TCPConn(addr, _family(ns))
+            err = conn.sock.connect_ex(addr)
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                self._close_tcp(conn, retry=False)
+                raise OSError(err, os.strerror(err))
+            self._sel.register(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, ("tcp", conn))
+        while q.qid in conn.pending and conn.pending[q.qid] is not q:
+            q.set_qid(random.randrange(1 << 16))
+        conn.pending[q.qid] = q
+        conn.outbuf += struct.pack("!H", len(q.wire)) + q.wire
+        conn.last_used = time.monotonic()
+        if conn.connected:
+            self._sel.modify(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, ("tcp", conn))
+
+    def _service_tcp(self, conn: _TCPConn, mask: int) -> None:
+        if self._tcp.get(conn.addr) is not conn:
+            return
+        try:
+            if mask & selectors.EVENT_WRITE:
+                if not conn.connected:
+                    err = conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if err:
+                        raise OSError(err, os.strerror(err))
+                    conn.connected = True
+                if conn.outbuf:
+                    sent = conn.sock.send(conn.outbuf)
+                    del conn.outbuf[:sent]
+                if not conn.outbuf:
+                    self._sel.modify(conn.sock, selectors.EVENT_READ, ("tcp", conn))
+            if mask & selectors.EVENT_READ:
+                chunk = conn.sock.recv(65535)
+                if not chunk:
+                    raise ConnectionResetError("nameserver closed TCP connection")
+                conn.inbuf += chunk
+                self._read_tcp_frames(conn)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            for q in conn.pending.values():
+                q.errors.append((conn.addr[0], True, self.port, e, None))
+            self._close_tcp(conn, retry=True)
+
+    def _read_tcp_frames(self, conn: _TCPConn) -> None:
+        while len(conn.inbuf) >= 2:
+            (size,) = struct.unpack("!H", conn.inbuf[:2])
+            if len(conn.inbuf) < 2 + size:
+                return
+            data = bytes(conn.inbuf[2:2 + size])
+            del conn.inbuf[:2 + size]
+            conn.last_used = time.monotonic()
+            if size < 12:
+                continue
+            q = conn.pending.get(struct.unpack("!H", data[:2])[0])
+            if q is None or q.done:
+                continue
+            response = self._parse(q, data)
+            if response is not None:
+                del conn.pending[q.qid]
+                self._guarded(q, self._handle_response, q, response, conn.addr[0])
+
+    def _close_tcp(self, conn: _TCPConn, retry: bool) -> None:
+        """Close a connection; its unanswered queries are resent on the next attempt."""
+        if self._tcp.get(conn.addr) is conn:
+            del self._tcp[conn.addr]
+        try:
+            self._sel.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
+        pending, conn.pending = list(conn.pending.values()), {}
+        if retry:
+            for q in pending:
+                if not q.done:
+                    self._guarded(q, self._retry, q)
+
+    def _close_idle_tcp(self) -> None:
+        now = time.monotonic()
+        for conn in list(self._tcp.values()):
+            if not conn.pending and now - conn.last_used > TCP_IDLE:
+                self._close_tcp(conn, retry=False)
+
+    def _parse(self, q: _Query, data: bytes):
+        try:
+            response = dns.message.from_wire(data)
+        except Exception:
+            return None
+        return response if q.msg.is_response(response) else None
+
+    def _handle_response(self, q: _Query, response, ns: str) -> None:
+        rcode = response.rcode()
+        if rcode == dns.rcode.NXDOMAIN:
+            self._finish(q, exc=dns.resolver.NXDOMAIN(qnames=[q.qname], responses={q.qname: response}))
+        elif rcode == dns.rcode.NOERROR:
+            try:
+                answer = dns.resolver.Answer(q.qname, q.rdtype, dns.rdataclass.IN, response, ns, self.port)
+            except Exception as e:
+                self._finish(q, exc=e)
+                return
+            if answer.rrset is None:
+                self._finish(q, exc=dns.resolver.NoAnswer(response=response))
+            else:
+                self._finish(q, result=answer)
+        else:
+            # SERVFAIL / REFUSED / ...: try the next nameserver
+            q.errors.append((ns, q.tcp, self.port, dns.rcode.to_text(rcode), response))
+            self._retry(q)
+
+    def _fire_timers(self) -> None:
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, q, attempt = heapq.heappop(self._timers)
+            if q.done or q.attempt != attempt:
+                continue  # answered, or already retried
+            self._guarded(q, self._retry, q)
+
+    def _retry(self, q: _Query) -> None:
+        q.attempt += 1
+        if q.attempt >= self.max_attempts or time.monotonic() >= q.deadline:
+            self._fail(q)
+            return
+        if not q.tcp:
+            self._unbind(q)
+        q.ns_index += 1
+        self._send(q)
+
+    def _fail(self, q: _Query) -> None:
+        answered = [e for e in q.errors if e[4] is not None]
+        if answered:
+            self._finish(q, exc=dns.resolver.NoNameservers(request=q.msg, errors=q.errors))
+        else:
+            elapsed = time.monotonic() - q.started
+            self._finish(q, exc=dns.resolver.LifetimeTimeout(timeout=elapsed, errors=q.errors))
+
+    def _forget(self, q: _Query) -> None:
+        q.done = True
+        if self._inflight.get(q.key) is q:
+            del self._inflight[q.key]
+        self._unbind(q)
+        for conn in self._tcp.values():
+            if conn.pending.get(q.qid) is q:
+                del conn.pending[q.qid]
+
+    def _finish(self, q: _Query, result=None, exc: BaseException | None = None) -> None:
+        self._forget(q)
+        for fut in q.waiters:
+            _settle(fut, result, exc)
+
+
+def _settle(fut: Future, result=None, exc: BaseException | None = None) -> None:
+    try:
+        if exc is not None:
+            fut.set_exception(exc)
+        else:
+            fut.set_result(result)
+    except InvalidStateError:
+        pass  # cancelled by the caller meanwhile
+
+
+def _is_ip(value: str) -> bool:
+    try:
+        ipaddress.ip_address(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _canonical_ip(value: str) -> str:
+    return str(ipaddress.ip_address(value))
+
+
+def _family(ip: str) -> int:
+    return socket.AF_INET6 if ":" in ip else socket.AF_INET
+
+
+def gather(futures: list[Future], timeout: float, abort: Callable[[], bool] | None = None) -> list:
+    """
+    Wait for futures up to timeout, or until abort() returns True (e.g. the
+    client went away); unfinished ones are cancelled and reported as timeouts.
+    """
+    end = time.monotonic() + timeout
+    while True:
+        left = end - time.monotonic()
+        done, pending = wait(futures, timeout=max(0.0, min(left, ABORT_POLL) if abort else left))
+        if not pending or left <= 0 or (abort and abort()):
+            break
+    results = []
+    for fut in futures:
+        if fut in done and not fut.cancelled():
+            results.append(fut.exception() or fut.result())
+        else:
+            fut.cancel()
+            results.append(dns.resolver.LifetimeTimeout(timeout=timeout, errors=[]))
+    return results
+
+
+# ===============================================================
+# Process-wide engine (re-created after fork: threads don't survive it)
+# ===============================================================
+_engine: DNSEngine | None = None
+_engine_lock = threading.Lock()
+
+def get_engine() -> DNSEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None or _engine.pid != os.getpid():
+            _engine = DNSEngine()
+        return _engine
+
+def resolve(qname, rdtype, lifetime: float | None = None,
+            abort: Callable[[], bool] | None = None) -> dns.resolver.Answer:
+    """Shortcut for get_engine().resolve()."""
+    return get_engine().resolve(qname, rdtype, lifetime, abort)
+
+def resolve_many(questions: Iterable[Question], lifetime: float | None = None,
+                 abort: Callable[[], bool] | None = None) -> list:
+    """Shortcut for get_engine().resolve_many()."""
+    return get_engine().resolve_many(questions, lifetime, abort)
+
+
+if hasattr(os, "register_at_fork"):
+    # The lock may have been held by another thread at fork time
+    os.register_at_fork(after_in_child=lambda: globals().update(_engine_lock=threading.Lock()))
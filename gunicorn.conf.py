@@ -0,0 +1,23 @@
+# ===============================================================
+# gunicorn.conf.py — Dovecot.io production server config
+# Description: Preload the app in the master, then fork workers so
+#              read-only state is shared copy-on-write.
+# License: MIT
+# ===============================================================
+
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:80")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+preload_app = True
+# app.REQUEST_DEADLINE (default 25 s) must stay below this
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+
+
+def when_ready(server):
+    """Runs in the master after app:app is imported, before any worker forks."""
+    import app
+    app.preload()
+    # One monitor for all workers (its own process, forked from here and
+    # restarted by the master if it dies); it must not keep our listeners
+    app.start_monitor_service(server.LISTENERS)
@@ -0,0 +1,538 @@
+# ===============================================================
+# monitor.py — Scheduled domain monitoring
+# Description: Re-checks watched domains in the background. DNS checks
+#              are re-run when their records' TTL expires, network probes
+#              on a jittered interval; only changes are kept. Under gunicorn
+#              one Monitor runs in a service process shared by all workers.
+# License: MIT
+# ===============================================================
+
+from __future__ import annotations
+import atexit, heapq, hmac, itertools, json, logging, os, queue, random, secrets, select, shutil, signal, tempfile, threading, time
+from collections import deque
+from datetime import datetime
+from multiprocessing.managers import BaseManager
+from typing import Callable
+import dns.resolver, dns.reversename
+import dns_engine
+
+log = logging.getLogger(__name__)
+
+MIN_INTERVAL = 60                 # never re-check faster than this (s)
+MAX_INTERVAL = 6 * 3600           # re-check at least this often (s)
+NEGATIVE_TTL = 300                # NXDOMAIN / NoAnswer re-check (s)
+ERROR_RETRY = 120                 # transient failure retry (s)
+PROBE_INTERVAL = 15 * 60          # DNSBL / PTR probes (s)
+TTL_JITTER = 0.10                 # +0..10% on TTL-driven checks
+PROBE_JITTER = 0.20               # ±20% on probe intervals
+INITIAL_SPREAD = 300              # first run spread over this window (s)
+WATCH_TTL = 30 * 86400            # a watch expires unless re-registered (s)
+
+DNSBL_ZONES = (
+    "zen.spamhaus.org",
+    "bl.spamcop.net",
+    "dnsbl.sorbs.net",
+    "b.barracudacentral.org",
+)
+
+# ===============================================================
+# Checks: each returns (snapshot, seconds until next run)
+# Snapshots are JSON-able and compared by equality.
+# ===============================================================
+def _ttl(answer) -> int:
+    return answer.rrset.ttl if answer.rrset is not None else NEGATIVE_TTL
+
+def _txt(name: str, prefix: str) -> tuple[str | None, int]:
+    try:
+        answer = dns_engine.resolve(name, "TXT")
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        return None, NEGATIVE_TTL
+    txts = [b"".join(r.strings).decode("utf-8", "replace") for r in answer]
+    return next((t for t in txts if t.startswith(prefix)), None), _ttl(answer)
+
+def check_mx(domain: str):
+    try:
+        answer = dns_engine.resolve(domain, "MX")
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        return [], NEGATIVE_TTL
+    hosts = sorted(f"{int(r.preference)} {str(r.exchange).rstrip('.')}" for r in answer)
+    return hosts, _ttl(answer)
+
+def check_spf(domain: str):
+    return _txt(domain, "v=spf1")
+
+def check_dmarc(domain: str):
+    return _txt(f"_dmarc.{domain}", "v=DMARC1")
+
+def check_mta_sts(domain: str):
+    return _txt(f"_mta-sts.{domain}", "v=STSv1")
+
+def _ipv4(domain: str) -> str:
+    return str(dns_engine.resolve(domain, "A")[0])
+
+def check_dnsbl(domain: str):
+    rev_ip = ".".join(reversed(_ipv4(domain).split(".")))
+    answers = dns_engine.resolve_many([(f"{rev_ip}.{bl}", "A") for bl in DNSBL_ZONES])
+    listed = []
+    for bl, ans in zip(DNSBL_ZONES, answers):
+        if isinstance(ans, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+            continue
+        if isinstance(ans, Exception):
+            raise ans  # transient: retry later rather than report a delisting
+        listed.append(bl)
+    return listed, PROBE_INTERVAL
+
+def check_ptr(domain: str):
+    ip = _ipv4(domain)
+    try:
+        ptr = str(dns_engine.resolve(dns.reversename.from_address(ip), "PTR")[0]).rstrip(".")
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        ptr = None
+    return {"ip": ip, "ptr": ptr}, PROBE_INTERVAL
+
+
+# name -> (check function, is_probe)
+CHECKS: dict[str, tuple[Callable[[str], tuple[object, int]], bool]] = {
+    "mx": (check_mx, False),
+    "spf": (check_spf, False),
+    "dmarc": (check_dmarc, False),
+    "mta_sts": (check_mta_sts, False),
+    "dnsbl": (check_dnsbl, True),
+    "ptr": (check_ptr, True),
+}
+
+def next_delay(seconds: float, probe: bool) -> float:
+    """Clamp to [MIN_INTERVAL, MAX_INTERVAL] and add jitter so runs never align."""
+    seconds = max(MIN_INTERVAL, min(MAX_INTERVAL, seconds))
+    if probe:
+        return seconds * random.uniform(1 - PROBE_JITTER, 1 + PROBE_JITTER)
+    # TTL-driven: never before expiry, only later
+    return seconds * random.uniform(1.0, 1 + TTL_JITTER)
+
+def diff(old, new) -> dict:
+    """Describe a change: added/removed for lists, old/new otherwise."""
+    if isinstance(old, list) and isinstance(new, list):
+        return {
+            "added": [x for x in new if x not in old],
+            "removed": [x for x in old if x not in new],
+        }
+    return {"old": old, "new": new}
+
+# ===============================================================
+# Scheduler
+# ===============================================================
+class ClientLimitError(OverflowError):
+    """The registering client already has max_per_client watches."""
+
+
+class Watch:
+    """State for one watched domain."""
+
+    def __init__(self, domain: str, checks: list[str], max_changes: int, client: str = ""):
+        self.domain = domain
+        self.checks = checks
+        self.client = client                    # who registered it (per-client limit)
+        self.token = secrets.token_urlsafe(16)  # proves ownership; never in to_dict()
+        self.generation = 0
+        self.last: dict[str, object] = {}
+        self.last_run: dict[str, float] = {}
+        self.changes: deque = deque(maxlen=max_changes)
+        self.created = time.time()
+        self.expires = self.created + WATCH_TTL
+
+    def to_dict(self) -> dict:
+        return {
+            "domain": self.domain,
+            "checks": self.checks,
+            "last_run": {
+                k: datetime.fromtimestamp(v).isoformat(timespec="seconds")
+                for k, v in self.last_run.items()
+            },
+            "changes": list(self.changes),
+            "expires": datetime.fromtimestamp(self.expires).isoformat(timespec="seconds"),
+        }
+
+
+class Monitor:
+    """
+    Min-heap of (due, seq, domain, check, generation) drained by one
+    scheduler thread into a bounded task queue served by worker threads.
+    Due times are time.monotonic(); wall time is only for display.
+    - first runs are spread uniformly over INITIAL_SPREAD
+    - every re-run is jittered, so schedules drift apart over time
+    - the bounded queue back-pressures the scheduler: a backlog is
+      worked off at worker speed instead of as a burst
+    - anonymous registration is bounded: max_per_client watches per
+      client, and a watch expires WATCH_TTL after its last registration
+    """
+
+    def __init__(self, workers: int = 8, max_domains: int = 50000, max_changes: int = 50,
+                 state_file: str | None = None, max_per_client: int = 20):
+        self.workers = workers
+        self.max_domains = max_domains
+        self.max_changes = max_changes
+        self.max_per_client = max_per_client
+        self.state_file = state_file  # registrations survive a restart of the service
+        self._watches: dict[str, Watch] = {}
+        self._per_client: dict[str, int] = {}
+        self._heap: list[tuple[float, int, str, str, int]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._tasks: queue.Queue = queue.Queue(maxsize=workers * 4)
+        self._started = False
+
+    # ---------- public API ----------
+    def watch(self, domain: str, checks: list[str] | None = None, token: str | None = None,
+              client: str = "") -> dict:
+        """
+        Register a domain; returns its state plus the watch token.
+        Changing the checks of an existing watch (which also renews it)
+        requires its token.
+        """
+        if checks is not None and (
+            not isinstance(checks, list) or not all(isinstance(c, str) for c in checks)
+        ):
+            raise ValueError("checks must be a list of strings")
+        checks = [c for c in (checks or list(CHECKS)) if c in CHECKS]
+        if not checks:
+            raise ValueError("no valid checks")
+        self._ensure_started()
+        with self._cond:
+            w = self._live(domain)
+            if w is None:
+                if len(self._watches) >= self.max_domains:
+                    raise OverflowError("watch list is full")
+                if self._per_client.get(client, 0) >= self.max_per_client:
+                    raise ClientLimitError("too many watches for this client")
+                w = Watch(domain, checks, self.max_changes, client)
+                self._add(w)
+            else:
+                self._authorize(w, token)
+                w.checks = checks
+                w.expires = time.time() + WATCH_TTL
+            self._schedule(w)
+            self._save()
+            return {**w.to_dict(), "token": w.token}
+
+    def unwatch(self, domain: str, token: str | None = None) -> bool:
+        """Stop watching (token required); pending heap entries are discarded lazily."""
+        with self._cond:
+            w = self._live(domain)
+            if w is None:
+                return False
+            self._authorize(w, token)
+            self._remove(w)
+            self._save()
+            return True
+
+    def status(self, domain: str) -> dict | None:
+        with self._cond:
+            w = self._live(domain)
+            return w.to_dict() if w else None
+
+    def __len__(self) -> int:
+        return len(self._watches)
+
+    def restore(self) -> int:
+        """Re-register the watches saved in state_file; returns how many."""
+        if not self.state_file or not os.path.exists(self.state_file):
+            return 0
+        with open(self.state_file, encoding="utf-8") as f:
+            saved = json.load(f)
+        self._ensure_started()
+        with self._cond:
+            now = time.time()
+            for item in saved:
+                if (item["domain"] in self._watches or len(self._watches) >= self.max_domains
+                        or item["expires"] <= now):
+                    continue
+                w = Watch(item["domain"], [c for c in item["checks"] if c in CHECKS],
+                          self.max_changes, item["client"])
+                w.token, w.expires = item["token"], item["expires"]
+                self._add(w)
+                self._schedule(w)
+            return len(self._watches)
+
+    # ---------- internals ----------
+    # Callers of the helpers below hold _cond.
+    def _live(self, domain: str) -> Watch | None:
+        """The watch for domain, dropping it if it has expired."""
+        w = self._watches.get(domain)
+        if w is not None and w.expires <= time.time():
+            self._remove(w)
+            self._save()
+            return None
+        return w
+
+    def _add(self, w: Watch) -> None:
+        self._watches[w.domain] = w
+        self._per_client[w.client] = self._per_client.get(w.client, 0) + 1
+
+    def _remove(self, w: Watch) -> None:
+        del self._watches[w.domain]
+        left = self._per_client.pop(w.client) - 1
+        if left:
+            self._per_client[w.client] = left
+
+    def _schedule(self, w: Watch) -> None:
+        """(Re)start every check of w; older heap entries become stale."""
+        w.generation += 1
+        now = time.monotonic()
+        for check in w.checks:
+            self._push(now + random.uniform(0, INITIAL_SPREAD), w.domain, check, w.generation)
+        self._cond.notify()
+
+    def _save(self) -> None:
+        """Write registrations to state_file (atomically)."""
+        if not self.state_file:
+            return
+        saved = [{"domain": w.domain, "checks": w.checks, "token": w.token, "client": w.client,
+                  "expires": w.expires} for w in self._watches.values()]
+        tmp = f"{self.state_file}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(saved, f)
+        os.replace(tmp, self.state_file)
+
+    @staticmethod
+    def _authorize(w: Watch, token: str | None) -> None:
+        if not isinstance(token, str) or not hmac.compare_digest(token, w.token):
+            raise PermissionError("invalid or missing watch token")
+
+    def _push(self, due: float, domain: str, check: str, generation: int) -> None:
+        heapq.heappush(self._heap, (due, next(self._seq), domain, check, generation))
+
+    def _ensure_started(self) -> None:
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._schedule_loop, name="monitor-scheduler", daemon=True).start()
+        for i in range(self.workers):
+            threading.Thread(target=self._work_loop, name=f"monitor-worker-{i}", daemon=True).start()
+
+    def _schedule_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                _, _, domain, check, generation = heapq.heappop(self._heap)
+                w = self._live(domain)
+                if w is None or w.generation != generation or check not in w.checks:
+                    continue  # stale entry (unwatched, expired or re-registered)
+            # Blocks when workers are saturated (back-pressure)
+            self._tasks.put((domain, check, generation))
+
+    def _work_loop(self) -> None:
+        while True:
+            domain, check, generation = self._tasks.get()
+            fn, probe = CHECKS[check]
+            try:
+                snapshot, seconds = fn(domain)
+                ok = True
+            except Exception as e:
+                log.info("monitor check failed", extra={
+                    "sample": "monitor_error",
+                    "fields": {"domain": domain, "check": check, "error": str(e)},
+                })
+                snapshot, seconds, ok = None, ERROR_RETRY, False
+
+            with self._cond:
+                w = self._watches.get(domain)
+                if w is None or w.generation != generation:
+                    continue
+                if ok:
+                    self._record(w, check, snapshot, time.time())
+                self._push(time.monotonic() + next_delay(seconds, probe), domain, check, generation)
+                self._cond.notify()
+
+    def _record(self, w: Watch, check: str, snapshot, now: float) -> None:
+        w.last_run[check] = now
+        if check not in w.last:
+            w.last[check] = snapshot  # baseline, not a change
+            return
+        old = w.last[check]
+        if old == snapshot:
+            return
+        w.last[check] = snapshot
+        w.changes.append({
+            "check": check,
+            "at": datetime.fromtimestamp(now).isoformat(timespec="seconds"),
+            **diff(old, snapshot),
+        })
+
+# ===============================================================
+# Shared service: one Monitor in a process of its own (forked by the
+# gunicorn master), every worker talks to it through a proxy
+# ===============================================================
+class MonitorManager(BaseManager):
+    pass
+
+_local: Monitor | None = None       # the Monitor, in the process that runs it
+_service_address = ""
+_service_key = b""
+_service_pid = 0
+_service_options: dict = {}
+_service_inherited: list = []      # master sockets the service must not keep open
+_stopping = False
+_proxy = None
+_proxy_pid = 0
+
+SERVICE_START_TIMEOUT = 10         # s to wait for a (re)started service to listen
+SERVICE_POLL = 1.0                 # how often the master checks the service is alive
+SERVICE_RESTART_MAX_DELAY = 30     # backoff cap between failed restarts (s)
+
+def _service_monitor() -> Monitor:
+    return _local
+
+MonitorManager.register(
+    "monitor", callable=_service_monitor,
+    exposed=("watch", "unwatch", "status", "__len__"),
+)
+
+def _run_service(ready: int) -> None:
+    """Body of the service process; never returns."""
+    global _local
+    try:
+        # Don't hold the master's listening sockets (connections would
+        # still be queued to us after gunicorn closed its copy)
+        for sock in _service_inherited:
+            sock.close()
+        # Drop the signal handlers inherited from the gunicorn master
+        for name in ("SIGTERM", "SIGHUP", "SIGQUIT", "SIGUSR1", "SIGUSR2",
+                     "SIGWINCH", "SIGTTIN", "SIGTTOU", "SIGCHLD"):
+            signal.signal(getattr(signal, name), signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # the master stops us
+        _local = Monitor(**_service_options)
+        try:
+            _local.restore()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.warning("monitor state not restored", extra={"fields": {"error": str(e)}})
+        if os.path.exists(_service_address):
+            os.unlink(_service_address)  # left behind by a crashed predecessor
+        server = MonitorManager(address=_service_address, authkey=_service_key).get_server()
+        os.write(ready, b"1")
+        os.close(ready)
+        server.serve_forever()
+    finally:
+        os._exit(0)
+
+def _spawn_service() -> int:
+    """Fork the service and wait until it listens; returns its pid."""
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        _run_service(w)
+    os.close(w)
+    with os.fdopen(r, "rb") as ready:
+        # select(): a worker forked meanwhile may hold the write end too
+        started = bool(select.select([ready], [], [], SERVICE_START_TIMEOUT)[0]) and ready.read(1) == b"1"
+    if not started:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        raise RuntimeError("monitor service failed to start")
+    return pid
+
+def _service_alive(pid: int) -> bool:
+    try:
+        return os.waitpid(pid, os.WNOHANG) == (0, 0)
+    except ChildProcessError:
+        return False  # already reaped (gunicorn reaps every child)
+
+def _supervise() -> None:
+    """Master thread: restart the service (with backoff) whenever it exits."""
+    global _service_pid
+    delay = 1.0
+    while not _stopping:
+        time.sleep(SERVICE_POLL)
+        if _stopping or _service_alive(_service_pid):
+            continue
+        log.warning("monitor service exited, restarting", extra={"fields": {"pid": _service_pid}})
+        while not _stopping:
+            try:
+                _service_pid = _spawn_service()
+                log.info("monitor service restarted", extra={"fields": {"pid": _service_pid}})
+                delay = 1.0
+                break
+            except Exception as e:
+                log.error("monitor service restart failed", extra={"fields": {"error": str(e)}})
+                time.sleep(delay)
+                delay = min(delay * 2, SERVICE_RESTART_MAX_DELAY)
+
+def _stop_service(owner: int) -> None:
+    global _stopping
+    if os.getpid() != owner:
+        return  # inherited by a worker
+    _stopping = True
+    try:
+        os.kill(_service_pid, signal.SIGTERM)
+        os.waitpid(_service_pid, 0)
+    except (ProcessLookupError, ChildProcessError):
+        pass
+    shutil.rmtree(os.path.dirname(_service_address), ignore_errors=True)
+
+def start_service(inherited=(), **options) -> None:
+    """
+    Fork the service process (call once, in the gunicorn master before
+    workers fork) and keep it running: a master thread restarts it if it
+    dies. inherited: master sockets the service closes after the fork.
+    Only the service holds its socket, so while it is down clients fail
+    fast instead of hanging; workers inherit the address and authkey.
+    With no state_file option, registrations are kept in the socket's
+    private directory (they survive a restart, not a redeploy).
+    """
+    global _service_address, _service_key, _service_pid, _service_options, _service_inherited
+    if _service_pid:
+        return
+    _service_key = os.urandom(32)
+    directory = tempfile.mkdtemp(prefix="monitor-")
+    _service_address = os.path.join(directory, "service.sock")
+    _service_options = {"state_file": os.path.join(directory, "watches.json"), **options}
+    _service_inherited = list(inherited)
+    _service_pid = _spawn_service()
+    atexit.register(_stop_service, os.getpid())
+    threading.Thread(target=_supervise, name="monitor-supervisor", daemon=True).start()
+    log.info("monitor service started", extra={"fields": {"pid": _service_pid}})
+
+def _connect():
+    global _proxy, _proxy_pid
+    if _proxy is not None:
+        # Proxies share one connection per thread and address: drop the dead one
+        tls = _proxy._tls
+        if hasattr(tls, "connection"):
+            tls.connection.close()
+            del tls.connection
+    client = MonitorManager(address=_service_address, authkey=_service_key)
+    client.connect()
+    _proxy, _proxy_pid = client.monitor(), os.getpid()
+    return _proxy
+
+def get_monitor(**options):
+    """
+    Proxy to the shared service if one was started, else a Monitor
+    local to this process (single-process dev server).
+    """
+    global _local
+    if not _service_pid:
+        if _local is None:
+            _local = Monitor(**options)
+        return _local
+    if _proxy is None or _proxy_pid != os.getpid():
+        return _connect()
+    return _proxy
+
+def call(method: str, *args, **options):
+    """
+    Monitor method via get_monitor(); after a dropped connection (service
+    restarted) reconnect once. Errors raised by the Monitor itself
+    (ValueError, PermissionError, ...) come through unchanged.
+    """
+    try:
+        return getattr(get_monitor(**options), method)(*args)
+    except (ConnectionError, EOFError, FileNotFoundError):
+        if not _service_pid:
+            raise
+    return getattr(_connect(), method)(*args)
@@ -0,0 +1,285 @@
+# ===============================================================
+# mta_sts.py — MTA-STS / TLS-RPT / BIMI checks
+# Description: Batched TXT discovery (dns_engine), HTTPS policy fetch
+#              over a pooled session, policy cache keyed by id + max_age.
+# License: MIT
+# ===============================================================
+
+from __future__ import annotations
+import sys, threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable
+import dns.exception, dns.resolver
+import dns_engine
+
+POLICY_PATH = "/.well-known/mta-sts.txt"
+POLICY_URL = "https://mta-sts.{domain}" + POLICY_PATH
+POLICY_MAX_BYTES = 64 * 1024             # RFC 8461 §3.3: keep policies small
+POLICY_TIMEOUT = (3, 5)                  # (connect, read) seconds
+POLICY_MAX_AGE_CAP = 24 * 3600           # never trust a cached policy longer
+FETCH_THREADS = 16                       # concurrent deadline-bounded fetches
+CACHE_MAX_ENTRIES = 4096
+
+# ===============================================================
+# Pooled HTTP client (requests imported lazily: page-only workers skip it)
+# ===============================================================
+_session = None
+_session_lock = threading.Lock()
+
+def http_session():
+    """Keep-alive session with a bounded connection pool and no retries."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=0)
+            s.mount("https://", adapter)
+            s.headers["User-Agent"] = "dovecot.io-mta-sts-check/1.0"
+            _session = s
+        return _session
+
+_fetch_pool = None
+
+def fetch_pool() -> ThreadPoolExecutor:
+    """Threads for fetches that must return by a deadline (getaddrinfo can't be timed out)."""
+    global _fetch_pool
+    with _session_lock:
+        if _fetch_pool is None:
+            _fetch_pool = ThreadPoolExecutor(FETCH_THREADS, thread_name_prefix="mta-sts-fetch")
+        return _fetch_pool
+
+# ===============================================================
+# Parsing helpers
+# ===============================================================
+def txt_records(answer) -> list[str]:
+    """
+    TXT strings from a dns_engine result; multi-string records are joined
+    (RFC 7208 §3.3). NXDOMAIN / NoAnswer mean "no records"; other errors raise.
+    """
+    if isinstance(answer, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+        return []
+    if isinstance(answer, Exception):
+        raise answer
+    return [b"".join(r.strings).decode("utf-8", "replace") for r in answer]
+
+def parse_tags(record: str) -> dict[str, str]:
+    """Parse "v=STSv1; id=20240101" style tag lists into a dict."""
+    tags = {}
+    for part in record.split(";"):
+        key, sep, value = part.strip().partition("=")
+        if sep:
+            tags[key.strip()] = value.strip()
+    return tags
+
+def pick_record(records: list[str], version: str) -> str:
+    """Return the single record starting with v=<version>; raise if 0 or >1."""
+    found = [r for r in records if r.replace(" ", "").startswith(f"v={version}")]
+    if not found:
+        raise LookupError(f"no v={version} record")
+    if len(found) > 1:
+        raise LookupError(f"multiple v={version} records")
+    return found[0]
+
+def parse_policy(text: str) -> dict:
+    """Parse an MTA-STS policy file (RFC 8461 §3.2)."""
+    policy = {"version": None, "mode": None, "mx": [], "max_age": None}
+    for line in text.splitlines():
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        key, value = key.strip(), value.strip()
+        if key == "mx":
+            policy["mx"].append(value.lower().rstrip("."))
+        elif key == "max_age":
+            policy["max_age"] = int(value) if value.isdigit() else None
+        elif key in ("version", "mode"):
+            policy[key] = value
+    if policy["version"] != "STSv1":
+        raise ValueError("policy version is not STSv1")
+    if policy["mode"] not in ("enforce", "testing", "none"):
+        raise ValueError(f"invalid policy mode: {policy['mode']}")
+    if policy["max_age"] is None:
+        raise ValueError("policy max_age missing or invalid")
+    if policy["mode"] != "none" and not policy["mx"]:
+        raise ValueError("policy has no mx patterns")
+    return policy
+
+def mx_matches(pattern: str, host: str) -> bool:
+    """RFC 8461 §4.1: exact match, or "*." wildcard for exactly one left label."""
+    host = host.lower().rstrip(".")
+    if pattern.startswith("*."):
+        _, _, parent = host.partition(".")
+        return parent == pattern[2:]
+    return host == pattern
+
+# ===============================================================
+# Policy fetch + cache
+# ===============================================================
+class PolicyCache:
+    """
+    LRU of domain -> (record id, policy, expires_at).
+    A hit requires the same record id and an unexpired max_age.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data: OrderedDict[str, tuple[str, dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, domain: str, policy_id: str) -> dict | None:
+        with self._lock:
+            entry = self._data.get(domain)
+            if not entry:
+                return None
+            cached_id, policy, expires_at = entry
+            if cached_id != policy_id or time.monotonic() >= expires_at:
+                del self._data[domain]
+                return None
+            self._data.move_to_end(domain)
+            return policy
+
+    def put(self, domain: str, policy_id: str, policy: dict) -> None:
+        ttl = min(policy["max_age"], POLICY_MAX_AGE_CAP)
+        with self._lock:
+            self._data[domain] = (policy_id, policy, time.monotonic() + ttl)
+            self._data.move_to_end(domain)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+policy_cache = PolicyCache()
+
+def _deadline_passed(deadline: float | None) -> None:
+    if deadline is not None and time.monotonic() >= deadline:
+        raise TimeoutError("request deadline exceeded during policy fetch")
+
+def fetch_policy(domain: str, timeout: tuple[float, float] = POLICY_TIMEOUT,
+                 deadline: float | None = None) -> dict:
+    """
+    GET https://mta-sts.<domain>/.well-known/mta-sts.txt (no redirects, size-capped).
+    deadline (time.monotonic()) is checked between body chunks, so a server
+    trickling bytes can't stretch the fetch past the next chunk (get_policy()
+    stops waiting at the deadline itself).
+    """
+    url = POLICY_URL.format(domain=domain)
+    with http_session().get(url, timeout=timeout, allow_redirects=False, stream=True) as resp:
+        if resp.status_code != 200:
+            raise ValueError(f"policy fetch returned HTTP {resp.status_code}")
+        ctype = resp.headers.get("Content-Type", "")
+        if not ctype.startswith("text/plain"):
+            raise ValueError(f"policy Content-Type is {ctype or '(none)'}, expected text/plain")
+        body = b""
+        _deadline_passed(deadline)
+        for chunk in resp.iter_content(8192):
+            _deadline_passed(deadline)
+            body += chunk
+            if len(body) > POLICY_MAX_BYTES:
+                raise ValueError("policy file too large")
+    return parse_policy(body.decode("utf-8", "replace"))
+
+def get_policy(domain: str, policy_id: str, deadline: float | None = None) -> tuple[dict, bool]:
+    """
+    Return (policy, cached); only refetch when the id changed or max_age expired.
+    With a deadline (time.monotonic()) the refetch runs on fetch_pool() and
+    TimeoutError is raised once it passes, wherever the fetch is stuck
+    (getaddrinfo, connect, TLS or a slow body).
+    """
+    policy = policy_cache.get(domain, policy_id)
+    if policy is not None:
+        return policy, True
+    if deadline is None:
+        policy = fetch_policy(domain)
+    else:
+        budget = deadline - time.monotonic()
+        if budget <= 0:
+            raise TimeoutError("request deadline exceeded before policy fetch")
+        timeout = (min(POLICY_TIMEOUT[0], budget), min(POLICY_TIMEOUT[1], budget))
+        future = fetch_pool().submit(fetch_policy, domain, timeout, deadline)
+        try:
+            policy = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            future.cancel()
+            raise TimeoutError("request deadline exceeded during policy fetch") from None
+    policy_cache.put(domain, policy_id, policy)
+    return policy, False
+
+# ===============================================================
+# Checks
+# ===============================================================
+def is_timeout(e: BaseException) -> bool:
+    """DNS lifetime, socket or HTTP (requests) timeout."""
+    if isinstance(e, (TimeoutError, dns.exception.Timeout)):
+        return True
+    requests = sys.modules.get("requests")
+    return requests is not None and isinstance(e, requests.Timeout)
+
+def _mta_sts_result(domain: str, records: list[str], mx_hosts: list[str] | Exception,
+                    deadline: float | None) -> dict:
+    record = pick_record(records, "STSv1")
+    policy_id = parse_tags(record).get("id", "")
+    if not policy_id:
+        raise ValueError("record has no id")
+    policy, cached = get_policy(domain, policy_id, deadline)
+    result = {"record": record, "id": policy_id, "policy": policy, "cached": cached}
+    if isinstance(mx_hosts, Exception):
+        result["mx_error"] = str(mx_hosts)
+    else:
+        result["mx_check"] = [
+            {"host": h, "matched": any(mx_matches(p, h) for p in policy["mx"])}
+            for h in mx_hosts
+        ]
+    return result
+
+def _tag_result(records: list[str], version: str) -> dict:
+    record = pick_record(records, version)
+    return {"record": record, "tags": parse_tags(record)}
+
+def check_domain(domain: str, resolve_mx: Callable[[str], list[dict]],
+                 deadline: float | None = None, abort: Callable[[], bool] | None = None) -> dict:
+    """
+    Submit the _mta-sts / _smtp._tls / default._bimi TXT queries as one
+    batch, resolve MX while they are in flight, then fetch (or reuse) the
+    MTA-STS policy and match it against the MX set.
+    deadline (time.monotonic()) bounds the DNS lifetimes and the fetch;
+    abort() stops waiting early (e.g. client disconnected).
+    Each section carries either its data or an "error" string, plus
+    "timeout": true when it ran out of time.
+    """
+    lifetime = None if deadline is None else max(0.0, deadline - time.monotonic())
+    names = {
+        "mta_sts": f"_mta-sts.{domain}",
+        "tls_rpt": f"_smtp._tls.{domain}",
+        "bimi": f"default._bimi.{domain}",
+    }
+    engine = dns_engine.get_engine()
+    futures = dict(zip(names, engine.submit_many(((n, "TXT") for n in names.values()), lifetime)))
+    try:
+        mx_hosts = [r["host"] for r in resolve_mx(domain)]
+    except Exception as e:
+        mx_hosts = e
+    if deadline is not None:
+        lifetime = max(0.0, deadline - time.monotonic())
+    answers = dict(zip(futures, dns_engine.gather(
+        list(futures.values()), engine.lifetime if lifetime is None else lifetime, abort)))
+
+    builders = {
+        "mta_sts": lambda recs: _mta_sts_result(domain, recs, mx_hosts, deadline),
+        "tls_rpt": lambda recs: _tag_result(recs, "TLSRPTv1"),
+        "bimi": lambda recs: _tag_result(recs, "BIMI1"),
+    }
+    out = {}
+    for key, build in builders.items():
+        try:
+            out[key] = build(txt_records(answers[key]))
+        except Exception as e:
+            out[key] = {"error": str(e)}
+            if is_timeout(e):
+                out[key]["timeout"] = True
+    return out
@@ -0,0 +1,179 @@
+# ===============================================================
+# queue_logging.py — Non-blocking logging for the request path
+# Description: Bounded queue handler + background writer thread,
+#              structured fields and per-key sampling.
+# License: MIT
+# ===============================================================
+
+from __future__ import annotations
+import atexit, logging, os, queue, random, sys, threading
+from logging.handlers import QueueHandler, QueueListener
+
+DEFAULT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks:
+    - records are enqueued with put_nowait()
+    - when the queue is full the record is dropped and counted
+    - message formatting is left to the writer thread
+    """
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self._drop_lock = threading.Lock()
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stdlib version formats msg % args here, i.e. on the caller's
+        # thread. Only render tracebacks eagerly (frames must not outlive
+        # the request); everything else is formatted by the listener.
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of records tagged with extra={"sample": "<key>"}.
+    Untagged records and keys without a configured rate always pass.
+    """
+
+    def __init__(self, rates: dict[str, float] | None = None):
+        super().__init__()
+        self.rates = dict(rates or {})
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample", None)
+        if key is None:
+            return True
+        rate = self.rates.get(key, 1.0)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        return random.random() < rate
+
+
+class StructuredFormatter(logging.Formatter):
+    """Render extra={"fields": {...}} as trailing key=value pairs."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class _ReportingListener(QueueListener):
+    """QueueListener that reports dropped records once the queue drains."""
+
+    def __init__(self, q: queue.Queue, source: DroppingQueueHandler, *handlers):
+        super().__init__(q, *handlers, respect_handler_level=True)
+        self.source = source
+        self.reported = 0
+
+    def handle(self, record: logging.LogRecord) -> None:
+        dropped = self.source.dropped
+        if dropped > self.reported:
+            note = logging.makeLogRecord({
+                "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": "log queue full, records dropped",
+                "fields": {"dropped": dropped - self.reported, "total": dropped},
+            })
+            self.reported = dropped
+            super().handle(note)
+        super().handle(record)
+
+    def enqueue_sentinel(self) -> None:
+        # Block rather than raise queue.Full: this thread is draining the queue
+        self.queue.put(self._sentinel)
+
+
+_listener: _ReportingListener | None = None
+_handler: DroppingQueueHandler | None = None
+
+
+def parse_sample_rates(spec: str | None) -> dict[str, float]:
+    """Parse "request=0.1,geoip_error=0.5" into {key: rate}; bad items are ignored."""
+    rates = {}
+    for item in (spec or "").split(","):
+        key, _, value = item.partition("=")
+        try:
+            rates[key.strip()] = max(0.0, min(1.0, float(value)))
+        except ValueError:
+            continue
+    return rates
+
+
+def setup_logging(
+    level: int | str = logging.INFO,
+    queue_size: int = 10000,
+    sample_rates: dict[str, float] | None = None,
+    fmt: str = DEFAULT_FORMAT,
+) -> DroppingQueueHandler:
+    """
+    Route the root logger through a bounded queue drained by a writer thread.
+    Replaces any previously installed root handlers (like basicConfig(force=True)).
+    """
+    global _listener, _handler
+    shutdown_logging()
+
+    q: queue.Queue = queue.Queue(maxsize=queue_size)
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(StructuredFormatter(fmt))
+
+    _handler = DroppingQueueHandler(q)
+    _handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+        h.close()
+    root.addHandler(_handler)
+    root.setLevel(level)
+
+    _listener = _ReportingListener(q, _handler, stream)
+    _listener.start()
+    return _handler
+
+
+def shutdown_logging() -> None:
+    """Flush pending records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_count() -> int:
+    """Number of records dropped because the queue was full."""
+    return _handler.dropped if _handler else 0
+
+
+def _restart_after_fork() -> None:
+    # Threads do not survive fork(), and the parent's writer may have held the
+    # queue lock at fork time: give the child a fresh queue and writer thread.
+    global _listener
+    if _listener is not None:
+        q: queue.Queue = queue.Queue(maxsize=_listener.queue.maxsize)
+        _handler.queue = q
+        _handler._drop_lock = threading.Lock()
+        _handler.dropped = 0  # the parent's drops are the parent's to report
+        _listener = _ReportingListener(q, _handler, *_listener.handlers)
+        _listener.start()
+
+
+atexit.register(shutdown_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
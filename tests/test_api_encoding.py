@@ -0,0 +1,200 @@
+# ===============================================================
+# tests/test_api_encoding.py — JSON provider & response compression
+# Description: Accept-Encoding negotiation, compress_response() skip
+#              rules on a small Flask app, and OrjsonProvider output
+#              compared with Flask's DefaultJSONProvider.
+# Usage: python -m pytest -q tests
+# ===============================================================
+
+from __future__ import annotations
+import dataclasses, gzip, io, json, sys, uuid
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask, Response, jsonify, request, send_file
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import parse_accept_header
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import api_encoding
+
+BIG = {"items": [{"selector": f"s{i}", "error": "The DNS query name does not exist"} for i in range(100)]}
+FAKE_BROTLI = SimpleNamespace(compress=lambda data, quality: b"br" + gzip.compress(data, mtime=0)[:32])
+
+
+def accept(value: str):
+    return parse_accept_header(value)  # as request.accept_encodings
+
+
+@pytest.fixture
+def with_brotli(monkeypatch):
+    """brotli is optional; a stand-in makes "br" available."""
+    monkeypatch.setattr(api_encoding, "brotli", FAKE_BROTLI)
+
+
+# ===============================================================
+# negotiate_encoding()
+# ===============================================================
+@pytest.mark.parametrize("header, expected", [
+    ("", None),
+    ("gzip", "gzip"),
+    ("identity", None),
+    ("gzip;q=0", None),
+    ("*", "gzip"),
+    ("*, gzip;q=0", None),
+    ("deflate, gzip;q=0.5", "gzip"),
+])
+def test_negotiate_gzip_only(monkeypatch, header, expected):
+    monkeypatch.setattr(api_encoding, "brotli", None)
+    assert api_encoding.negotiate_encoding(accept(header)) == expected
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, br", "br"),                  # tie: server preference
+    ("gzip;q=0.8, br;q=0.8", "br"),
+    ("gzip;q=1.0, br;q=0.5", "gzip"),    # client quality wins
+    ("br;q=0, gzip", "gzip"),
+    ("br, gzip;q=0", "br"),
+])
+def test_negotiate_with_brotli(with_brotli, header, expected):
+    assert api_encoding.available_encodings() == ["br", "gzip"]
+    assert api_encoding.negotiate_encoding(accept(header)) == expected
+
+
+# ===============================================================
+# compress_response() on a Flask app
+# ===============================================================
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api_encoding, "brotli", None)
+    app = Flask(__name__)
+
+    @app.after_request
+    def compress(response):
+        return api_encoding.compress_response(response, request.accept_encodings, request.method)
+
+    @app.route("/big", methods=["GET", "HEAD"])
+    def big():
+        return jsonify(BIG)
+
+    @app.get("/small")
+    def small():
+        return jsonify({"ok": True})
+
+    @app.get("/missing")
+    def missing():
+        return jsonify(BIG), 404
+
+    @app.get("/stream")
+    def stream():
+        return Response((json.dumps(BIG) for _ in range(2)), mimetype="application/json")
+
+    @app.get("/file")
+    def file():
+        return send_file(io.BytesIO(json.dumps(BIG).encode()), mimetype="application/json")
+
+    return app.test_client()
+
+
+def test_large_json_is_gzipped(client):
+    resp = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in resp.headers["Vary"]
+    assert json.loads(gzip.decompress(resp.data)) == BIG
+    assert int(resp.headers["Content-Length"]) == len(resp.data)
+
+
+def test_uncompressed_when_not_accepted(client):
+    resp = client.get("/big", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "Content-Encoding" not in resp.headers
+    assert "Accept-Encoding" in resp.headers["Vary"]  # caches must still split on it
+    assert resp.get_json() == BIG
+
+
+def test_small_body_is_not_compressed(client):
+    resp = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in resp.headers
+    assert "Accept-Encoding" in resp.headers["Vary"]
+    assert resp.get_json() == {"ok": True}
+
+
+@pytest.mark.parametrize("method, path", [
+    ("HEAD", "/big"),
+    ("GET", "/missing"),
+    ("GET", "/stream"),
+    ("GET", "/file"),
+])
+def test_skipped_responses(client, method, path):
+    resp = client.open(path, method=method, headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in resp.headers
+
+
+def test_app_hook():
+    import app
+    client = app.app.test_client()
+    page = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert page.headers["Content-Encoding"] == "gzip"
+    assert b"<html" in gzip.decompress(page.data).lower()
+    error = client.post("/api/dkim", json={"target": ""}, headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in error.headers  # tiny body
+    assert "Accept-Encoding" in error.headers["Vary"]
+
+
+# ===============================================================
+# OrjsonProvider
+# ===============================================================
+@dataclasses.dataclass
+class Point:
+    x: int
+    y: int
+
+
+@pytest.fixture
+def providers():
+    if api_encoding.orjson is None:
+        pytest.skip("orjson not installed")
+    app = Flask(__name__)
+    return api_encoding.OrjsonProvider(app), DefaultJSONProvider(app), app
+
+
+def test_orjson_matches_stdlib(providers):
+    fast, std, _ = providers
+    obj = {
+        "b": [1, 2.5, None, True],
+        "a": "中文 text",
+        "when": datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+        "naive": datetime(2025, 1, 2, 3, 4, 5),
+        "day": date(2025, 1, 2),
+        "id": uuid.UUID(int=1),
+        "amount": Decimal("1.50"),
+        "point": Point(1, 2),
+    }
+    assert fast.loads(fast.dumps(obj)) == std.loads(std.dumps(obj))
+    assert fast.dumps({2: "b", 1: "a"}) == std.dumps({2: "b", 1: "a"}).replace(" ", "")  # non-str keys
+    assert fast.loads(fast.dumps(obj))["when"] == "Thu, 02 Jan 2025 03:04:05 GMT"  # HTTP date, like Flask
+
+
+def test_orjson_sorts_keys_and_writes_utf8(providers):
+    fast, std, _ = providers
+    text = fast.dumps({"b": "中", "a": 1})
+    assert text == '{"a":1,"b":"中"}'
+    assert std.dumps({"b": "中", "a": 1}) == '{"a": 1, "b": "\\u4e2d"}'  # same value, escaped
+
+
+def test_orjson_response(providers):
+    fast, _, app = providers
+    with app.app_context():
+        resp = fast.response(BIG)
+    assert resp.mimetype == "application/json"
+    assert resp.data.endswith(b"\n")
+    assert json.loads(resp.data) == BIG
+
+
+def test_pick_json_provider():
+    assert api_encoding.pick_json_provider("std") is DefaultJSONProvider
+    expected = DefaultJSONProvider if api_encoding.orjson is None else api_encoding.OrjsonProvider
+    assert api_encoding.pick_json_provider(None) is expected
+    assert api_encoding.pick_json_provider("orjson") is expected
@@ -0,0 +1,109 @@
+# ===============================================================
+# tests/test_app_deadline.py — Per-request time budget
+# Description: Deadline parsing and clamping, "timeout": true on an
+#              exhausted budget, and port probes cut off at the budget
+#              (a loopback listener with a full accept queue never answers).
+# Usage: python -m pytest -q tests
+# ===============================================================
+
+from __future__ import annotations
+import socket, sys, time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def budget(**kwargs) -> float:
+    with app.app.test_request_context("/api/ports", method="POST", **kwargs):
+        return app.request_deadline() - time.monotonic()
+
+
+@pytest.fixture
+def blackhole():
+    """A loopback port whose connects stay pending (SYNs dropped: backlog full)."""
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(0)
+    port = srv.getsockname()[1]
+    fill = []
+    for _ in range(3):
+        c = socket.socket()
+        c.setblocking(False)
+        c.connect_ex(("127.0.0.1", port))
+        fill.append(c)
+    time.sleep(0.05)
+    yield port
+    for c in fill:
+        c.close()
+    srv.close()
+
+
+# ===============================================================
+# request_deadline()
+# ===============================================================
+@pytest.mark.parametrize("hint, expected", [
+    (None, app.REQUEST_DEADLINE),
+    ("3", 3.0),
+    ("0.01", app.MIN_REQUEST_DEADLINE),
+    ("-5", app.MIN_REQUEST_DEADLINE),
+    ("1e9", app.REQUEST_DEADLINE),
+    ("inf", app.REQUEST_DEADLINE),
+    ("-inf", app.MIN_REQUEST_DEADLINE),
+    ("nan", app.REQUEST_DEADLINE),
+    ("soon", app.REQUEST_DEADLINE),
+])
+def test_header_budget_is_clamped(hint, expected):
+    headers = {} if hint is None else {"X-Request-Timeout": hint}
+    assert budget(headers=headers, json={}) == pytest.approx(expected, abs=0.05)
+
+
+@pytest.mark.parametrize("body, expected", [
+    ({"timeout": 2}, 2.0),
+    ({"timeout": -1}, app.MIN_REQUEST_DEADLINE),
+    ({"timeout": "nan"}, app.REQUEST_DEADLINE),
+    ({"timeout": "inf"}, app.REQUEST_DEADLINE),
+    ({"timeout": None}, app.REQUEST_DEADLINE),
+    ([1, 2], app.REQUEST_DEADLINE),
+])
+def test_json_budget_is_clamped(body, expected):
+    assert budget(json=body) == pytest.approx(expected, abs=0.05)
+
+
+def test_header_wins_over_json():
+    assert budget(headers={"X-Request-Timeout": "4"}, json={"timeout": 2}) == pytest.approx(4.0, abs=0.05)
+
+
+# ===============================================================
+# Exhausted budget
+# ===============================================================
+def test_spent_budget_reports_timeout(client, monkeypatch):
+    monkeypatch.setattr(app, "MIN_REQUEST_DEADLINE", 0)
+    body = client.post("/api/ports", json={"host": "127.0.0.1", "timeout": 0}).get_json()
+    assert body["ok"] is False
+    assert body["timeout"] is True
+
+
+def test_probe_ports_marks_pending_as_timed_out(blackhole):
+    with app.app.test_request_context("/api/ports", method="POST", json={}):
+        started = time.monotonic()
+        results = app.probe_ports("127.0.0.1", [blackhole], 0.3)
+        assert time.monotonic() - started < 1.0
+    assert results == {blackhole: {"reachable": False, "note": "timed out", "timeout": True}}
+
+
+def test_ports_stop_at_request_budget(client, monkeypatch, blackhole):
+    monkeypatch.setattr(app, "MAIL_PORTS", [blackhole])
+    started = time.monotonic()
+    body = client.post("/api/ports", json={"host": "127.0.0.1"},
+                       headers={"X-Request-Timeout": "0.5"}).get_json()
+    assert time.monotonic() - started < app.PORT_TIMEOUT
+    assert body["ok"] is True
+    assert body["data"] == [{"service": str(blackhole), "reachable": False, "note": "timed out", "timeout": True}]
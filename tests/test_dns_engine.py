@@ -0,0 +1,222 @@
+# ===============================================================
+# tests/test_dns_engine.py — Multiplexed DNS engine
+# Description: Runs DNSEngine against a local fake nameserver (UDP + TCP
+#              on one port); the first label of the name picks the reply.
+# Usage: python -m pytest -q tests
+# ===============================================================
+
+from __future__ import annotations
+import socket, struct, sys, threading, time
+from collections import Counter
+from pathlib import Path
+
+import dns.flags, dns.message, dns.rcode, dns.resolver, dns.rrset
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import dns_engine
+from dns_engine import DNSEngine
+
+
+# ===============================================================
+# Fake nameserver
+# ===============================================================
+class FakeNameserver:
+    """
+    First label of the question name:
+      nx.*    NXDOMAIN            empty.*  NOERROR, no answer
+      drop.*  never answered      big.*    TC over UDP, full answer over TCP
+      slow.*  answered after 0.2 s   spoof.*  answered from another port
+      anything else: one TXT record
+    Counts queries per (transport, name), UDP source ports and TCP connections.
+    """
+
+    def __init__(self):
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind(("127.0.0.1", 0))
+        self.port = self.udp.getsockname()[1]
+        self.other = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.other.bind(("127.0.0.1", 0))
+        self.source_ports: set[int] = set()
+        self.tcp = socket.socket()
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind(("127.0.0.1", self.port))
+        self.tcp.listen()
+        self.queries: Counter = Counter()
+        self.connections = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self._udp_loop, daemon=True).start()
+        threading.Thread(target=self._tcp_loop, daemon=True).start()
+
+    def count(self, transport: str, name: str) -> int:
+        with self.lock:
+            return self.queries[(transport, name)]
+
+    def _answer(self, query, tcp: bool):
+        name = query.question[0].name.to_text()
+        kind = name.split(".")[0]
+        with self.lock:
+            self.queries[("tcp" if tcp else "udp", name)] += 1
+        if kind == "drop":
+            return None
+        if kind == "slow":
+            time.sleep(0.2)
+        response = dns.message.make_response(query)
+        if kind == "nx":
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        elif kind == "big" and not tcp:
+            response.flags |= dns.flags.TC
+        elif kind != "empty":
+            for i in range(20 if kind == "big" else 1):
+                response.answer.append(dns.rrset.from_text(name, 300, "IN", "TXT", f'"v=test {i}"'))
+        return response
+
+    def _udp_loop(self):
+        while True:
+            data, addr = self.udp.recvfrom(4096)
+            threading.Thread(target=self._udp_reply, args=(data, addr), daemon=True).start()
+
+    def _udp_reply(self, data, addr):
+        with self.lock:
+            self.source_ports.add(addr[1])
+        query = dns.message.from_wire(data)
+        response = self._answer(query, tcp=False)
+        if response is not None:
+            spoofed = query.question[0].name.to_text().startswith("spoof.")
+            (self.other if spoofed else self.udp).sendto(response.to_wire(), addr)
+
+    def _tcp_loop(self):
+        while True:
+            conn, _ = self.tcp.accept()
+            with self.lock:
+                self.connections += 1
+            threading.Thread(target=self._tcp_conn, args=(conn,), daemon=True).start()
+
+    def _tcp_conn(self, conn):
+        buf = b""
+        while True:
+            chunk = conn.recv(4096)
+            if not chunk:
+                return
+            buf += chunk
+            while len(buf) >= 2 and len(buf) >= 2 + struct.unpack("!H", buf[:2])[0]:
+                size = struct.unpack("!H", buf[:2])[0]
+                query, buf = dns.message.from_wire(buf[2:2 + size]), buf[2 + size:]
+                response = self._answer(query, tcp=True)
+                if response is not None:
+                    wire = response.to_wire()
+                    conn.sendall(struct.pack("!H", len(wire)) + wire)
+
+
+@pytest.fixture(scope="module")
+def nameserver():
+    return FakeNameserver()
+
+
+@pytest.fixture
+def engine(nameserver):
+    return DNSEngine(["127.0.0.1"], port=nameserver.port, lifetime=2.0)
+
+
+def wait_idle(engine, timeout=1.0) -> bool:
+    """Cancels are handled on the I/O thread: wait for it to drop its state."""
+    deadline = time.monotonic() + timeout
+    while (engine._inflight or engine._by_id) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return engine._inflight == {} and engine._by_id == {}
+
+
+# ===============================================================
+# Answers
+# ===============================================================
+def test_answer(engine):
+    answer = engine.resolve("ok.example", "TXT")
+    assert [str(r) for r in answer] == ['"v=test 0"']
+    assert answer.rrset.ttl == 300
+
+
+def test_nxdomain_and_noanswer(engine):
+    with pytest.raises(dns.resolver.NXDOMAIN):
+        engine.resolve("nx.example", "TXT")
+    with pytest.raises(dns.resolver.NoAnswer):
+        engine.resolve("empty.example", "TXT")
+    bad = engine.resolve_many([("bad..name", "TXT")])[0]
+    assert isinstance(bad, dns.exception.DNSException)
+
+
+def test_identical_questions_share_one_query(engine, nameserver):
+    results = engine.resolve_many([("slow.dedupe.example", "TXT")] * 50)
+    assert all(isinstance(r, dns.resolver.Answer) for r in results)
+    assert nameserver.count("udp", "slow.dedupe.example.") == 1  # still outstanding for all 50
+
+
+def test_truncated_answers_reuse_one_tcp_connection(engine, nameserver):
+    before = nameserver.connections
+    names = [f"big.tc{i}.example" for i in range(10)]
+    results = engine.resolve_many([(n, "TXT") for n in names])
+    assert [len(r) for r in results] == [20] * 10
+    assert all(nameserver.count("tcp", f"{n}.") == 1 for n in names)
+    assert nameserver.connections - before == 1
+
+
+# ===============================================================
+# Retries, limits & cancellation
+# ===============================================================
+def test_dropped_packets_retry_then_time_out(nameserver):
+    engine = DNSEngine(["127.0.0.1"], port=nameserver.port, attempt_timeout=0.1)
+    started = time.monotonic()
+    with pytest.raises(dns.resolver.LifetimeTimeout):
+        engine.resolve("drop.retry.example", "TXT", lifetime=1.0)
+    assert time.monotonic() - started < 1.5
+    assert wait_idle(engine)
+    assert nameserver.count("udp", "drop.retry.example.") == engine.max_attempts  # 0, .1, .3, .7 s
+
+
+def test_max_inflight_queues_the_rest(nameserver):
+    engine = DNSEngine(["127.0.0.1"], port=nameserver.port, max_inflight=2)
+    started = time.monotonic()
+    results = engine.resolve_many([(f"slow.q{i}.example", "TXT") for i in range(6)])
+    assert all(isinstance(r, dns.resolver.Answer) for r in results)
+    assert time.monotonic() - started >= 0.55  # three rounds of 0.2 s
+
+
+def test_abort_cancels_and_prunes(engine):
+    started = time.monotonic()
+    names = [(f"drop.abort{i}.example", "TXT") for i in range(5)]
+    results = engine.resolve_many(names, lifetime=5, abort=lambda: time.monotonic() - started > 0.3)
+    assert time.monotonic() - started < 1.0
+    assert all(isinstance(r, dns.resolver.LifetimeTimeout) for r in results)
+    assert wait_idle(engine)
+
+
+def test_gather_reports_unfinished_as_timeouts():
+    done, never = dns_engine.Future(), dns_engine.Future()
+    done.set_result("answer")
+    results = dns_engine.gather([done, never], timeout=0.1)
+    assert results[0] == "answer"
+    assert isinstance(results[1], dns.resolver.LifetimeTimeout)
+    assert never.cancelled()
+
+
+# ===============================================================
+# Spoofing resistance
+# ===============================================================
+def test_nameservers_are_normalized():
+    engine = DNSEngine(["::0001", "192.0.2.1", "not-an-ip"])
+    assert engine.nameservers == ["::1", "192.0.2.1"]
+
+
+def test_answer_from_wrong_port_is_ignored(engine, nameserver):
+    with pytest.raises(dns.resolver.LifetimeTimeout):
+        engine.resolve("spoof.example", "TXT", lifetime=0.5)
+
+
+def test_udp_sockets_rotate(nameserver, monkeypatch):
+    monkeypatch.setattr(dns_engine, "UDP_ROTATE_QUERIES", 2)
+    engine = DNSEngine(["127.0.0.1"], port=nameserver.port, udp_sockets=1)
+    with nameserver.lock:
+        nameserver.source_ports.clear()
+    for i in range(6):
+        engine.resolve(f"rotate{i}.example", "TXT")
+    assert len(nameserver.source_ports) == 3
+    assert len(engine._udp) == 1  # retired sockets are closed once idle
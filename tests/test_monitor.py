@@ -0,0 +1,160 @@
+# ===============================================================
+# tests/test_monitor.py — Monitor scheduling, diffs & watch ownership
+# Description: Pure helpers plus the Monitor's bookkeeping, run without
+#              its worker threads (no DNS traffic).
+# Usage: python -m pytest -q tests
+# ===============================================================
+
+from __future__ import annotations
+import queue, sys, threading, time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import monitor
+from monitor import ClientLimitError, Monitor, Watch, diff, next_delay
+
+
+@pytest.fixture
+def mon(monkeypatch) -> Monitor:
+    """A Monitor whose scheduler and worker threads are never started."""
+    m = Monitor(workers=1, max_domains=5, max_per_client=3)
+    monkeypatch.setattr(m, "_ensure_started", lambda: None)
+    return m
+
+
+# ===============================================================
+# next_delay / diff
+# ===============================================================
+@pytest.mark.parametrize("seconds, expected", [
+    (1, monitor.MIN_INTERVAL),
+    (3600, 3600),
+    (10 ** 9, monitor.MAX_INTERVAL),
+])
+def test_next_delay_clamps(monkeypatch, seconds, expected):
+    monkeypatch.setattr(monitor.random, "uniform", lambda a, b: 1.0)
+    assert next_delay(seconds, probe=False) == expected
+    assert next_delay(seconds, probe=True) == expected
+
+
+def test_next_delay_jitter_bounds(monkeypatch):
+    bounds = []
+    monkeypatch.setattr(monitor.random, "uniform", lambda a, b: bounds.append((a, b)) or b)
+    assert next_delay(1000, probe=False) == pytest.approx(1000 * (1 + monitor.TTL_JITTER))
+    assert next_delay(1000, probe=True) == pytest.approx(1000 * (1 + monitor.PROBE_JITTER))
+    # TTL-driven checks never run before the TTL expires
+    assert bounds == [(1.0, 1 + monitor.TTL_JITTER), (1 - monitor.PROBE_JITTER, 1 + monitor.PROBE_JITTER)]
+
+
+def test_diff():
+    assert diff(["10 a", "20 b"], ["20 b", "30 c"]) == {"added": ["30 c"], "removed": ["10 a"]}
+    assert diff("v=spf1 -all", None) == {"old": "v=spf1 -all", "new": None}
+    assert diff(None, ["x"]) == {"old": None, "new": ["x"]}
+
+
+# ===============================================================
+# Recording & scheduling
+# ===============================================================
+def test_record_baseline_then_changes(mon):
+    w = Watch("example.com", ["mx"], max_changes=2)
+    mon._record(w, "mx", ["10 a"], 1_700_000_000)
+    assert not w.changes and w.last["mx"] == ["10 a"]  # baseline, not a change
+    mon._record(w, "mx", ["10 a"], 1_700_000_060)  # unchanged
+    assert len(w.changes) == 0
+    mon._record(w, "mx", ["10 b"], 1_700_000_120)
+    mon._record(w, "mx", ["10 c"], 1_700_000_180)
+    mon._record(w, "mx", ["10 d"], 1_700_000_240)
+    assert [c["added"] for c in w.changes] == [["10 c"], ["10 d"]]  # bounded by max_changes
+    assert w.changes[-1]["at"] == w.to_dict()["last_run"]["mx"]  # wall time, for display
+
+
+def test_schedule_uses_monotonic_due_times(mon):
+    mon.watch("example.com", ["mx", "spf"])
+    now = time.monotonic()
+    assert len(mon._heap) == 2
+    assert all(now - 1 <= due <= now + monitor.INITIAL_SPREAD for due, *_ in mon._heap)
+
+
+def test_schedule_loop_drops_stale_entries():
+    m = Monitor(workers=1)
+    w = Watch("example.com", ["mx"], max_changes=5)
+    m._add(w)
+    w.generation = 2
+    past = time.monotonic() - 1
+    m._push(past, "example.com", "mx", 1)        # re-registered since
+    m._push(past, "gone.example", "mx", 1)       # unwatched
+    m._push(past, "example.com", "spf", 2)       # check no longer selected
+    m._push(past + 0.5, "example.com", "mx", 2)  # current
+    threading.Thread(target=m._schedule_loop, daemon=True).start()
+    assert m._tasks.get(timeout=2) == ("example.com", "mx", 2)
+    with pytest.raises(queue.Empty):
+        m._tasks.get(timeout=0.2)
+    assert m._heap == []
+
+
+# ===============================================================
+# Ownership & limits
+# ===============================================================
+def test_watch_token_checks(mon):
+    token = mon.watch("example.com", ["mx"])["token"]
+    with pytest.raises(PermissionError):
+        mon.watch("example.com", ["spf"])
+    with pytest.raises(PermissionError):
+        mon.watch("example.com", ["spf"], token="wrong")
+    assert mon.watch("example.com", ["spf"], token=token)["checks"] == ["spf"]
+    assert "token" not in mon.status("example.com")
+
+    with pytest.raises(PermissionError):
+        mon.unwatch("example.com", None)
+    with pytest.raises(PermissionError):
+        mon.unwatch("example.com", token[:-1] + "x")
+    assert mon.unwatch("example.com", token) is True
+    assert mon.unwatch("example.com", token) is False
+    assert mon.status("example.com") is None
+
+
+@pytest.mark.parametrize("checks", ["mx", [1], ["nope"]])
+def test_watch_rejects_bad_checks(mon, checks):
+    with pytest.raises(ValueError):
+        mon.watch("example.com", checks)
+
+
+def test_limits(mon):
+    for i in range(3):
+        mon.watch(f"a{i}.example", client="192.0.2.1")
+    with pytest.raises(ClientLimitError):
+        mon.watch("a3.example", client="192.0.2.1")
+    mon.watch("b0.example", client="192.0.2.2")
+    mon.watch("b1.example", client="192.0.2.2")
+    with pytest.raises(OverflowError):
+        mon.watch("b2.example", client="192.0.2.2")  # max_domains
+    mon.unwatch("a0.example", mon._watches["a0.example"].token)
+    mon.watch("a3.example", client="192.0.2.1")  # a slot freed up
+
+
+def test_watch_expires_and_renews(mon, monkeypatch):
+    token = mon.watch("example.com", client="192.0.2.1")["token"]
+    start = time.time()
+    monkeypatch.setattr(monitor.time, "time", lambda: start + monitor.WATCH_TTL - 10)
+    mon.watch("example.com", token=token)  # renewed
+    monkeypatch.setattr(monitor.time, "time", lambda: start + monitor.WATCH_TTL + 10)
+    assert mon.status("example.com") is not None
+    monkeypatch.setattr(monitor.time, "time", lambda: start + 2 * monitor.WATCH_TTL)
+    assert mon.status("example.com") is None
+    assert mon._per_client == {}
+
+
+def test_state_file_round_trip(tmp_path, monkeypatch):
+    state = tmp_path / "watches.json"
+    first = Monitor(state_file=str(state))
+    monkeypatch.setattr(first, "_ensure_started", lambda: None)
+    token = first.watch("example.com", ["mx"], client="192.0.2.1")["token"]
+    first.watch("other.example", ["spf"])
+
+    second = Monitor(state_file=str(state))
+    monkeypatch.setattr(second, "_ensure_started", lambda: None)
+    assert second.restore() == 2
+    assert second.status("example.com")["checks"] == ["mx"]
+    assert second._per_client == {"192.0.2.1": 1, "": 1}
+    assert second.unwatch("example.com", token) is True
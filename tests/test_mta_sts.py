@@ -0,0 +1,222 @@
+# ===============================================================
+# tests/test_mta_sts.py — MTA-STS parsing, policy fetch & cache
+# Description: Policy fetches run against a local HTTPS stand-in
+#              (http.server + self-signed cert trusted via session.verify).
+# Usage: python -m pytest -q tests
+# ===============================================================
+
+from __future__ import annotations
+import shutil, socket, ssl, subprocess, sys, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import mta_sts
+
+POLICY = "version: STSv1\nmode: enforce\nmx: mx1.example.com\nmx: *.mail.example.com\nmax_age: 86400\n"
+
+
+# ===============================================================
+# Local HTTPS stand-in
+# ===============================================================
+class PolicyHandler(BaseHTTPRequestHandler):
+    """
+    Serves server.routes[path] = (status, headers, body); counts hits.
+    Paths in server.drip send their body one byte per server.drip[path] seconds.
+    """
+
+    def do_GET(self):
+        self.server.hits[self.path] = self.server.hits.get(self.path, 0) + 1
+        status, headers, body = self.server.routes.get(self.path, (404, {}, b"not found"))
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        delay = self.server.drip.get(self.path)
+        if delay is None:
+            self.wfile.write(body)
+            return
+        for i in range(len(body)):
+            self.wfile.write(body[i:i + 1])
+            self.wfile.flush()
+            time.sleep(delay)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def cert(tmp_path_factory):
+    if not shutil.which("openssl"):
+        pytest.skip("openssl not available")
+    d = tmp_path_factory.mktemp("tls")
+    key, crt = d / "key.pem", d / "cert.pem"
+    subprocess.run([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+        "-keyout", str(key), "-out", str(crt), "-subj", "/CN=localhost",
+        "-addext", "subjectAltName=DNS:localhost",
+    ], check=True, capture_output=True)
+    return crt, key
+
+
+@pytest.fixture(scope="module")
+def server(cert):
+    crt, key = cert
+    srv = ThreadingHTTPServer(("localhost", 0), PolicyHandler)
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(crt, key)
+    srv.socket = ctx.wrap_socket(srv.socket, server_side=True)
+    srv.routes, srv.hits, srv.drip = {}, {}, {}
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture(autouse=True)
+def local_policy_host(server, cert, monkeypatch):
+    """Point POLICY_URL at the stand-in (one path per domain) and trust its cert."""
+    port = server.server_address[1]
+    monkeypatch.setattr(mta_sts, "POLICY_URL", f"https://localhost:{port}/{{domain}}{mta_sts.POLICY_PATH}")
+    monkeypatch.setattr(mta_sts.http_session(), "verify", str(cert[0]))
+    # requests lets these override session.verify
+    monkeypatch.delenv("REQUESTS_CA_BUNDLE", raising=False)
+    monkeypatch.delenv("CURL_CA_BUNDLE", raising=False)
+    server.routes.clear()
+    server.hits.clear()
+    server.drip.clear()
+    mta_sts.policy_cache.clear()
+    yield
+    mta_sts.policy_cache.clear()
+
+
+def serve(server, domain, body=POLICY, status=200, ctype="text/plain", **headers) -> str:
+    path = f"/{domain}{mta_sts.POLICY_PATH}"
+    data = body.encode() if isinstance(body, str) else body
+    server.routes[path] = (status, {"Content-Type": ctype, **headers}, data)
+    return path
+
+
+# ===============================================================
+# Parsing
+# ===============================================================
+@pytest.mark.parametrize("text, error", [
+    ("version: STSv2\nmode: enforce\nmx: a.example\nmax_age: 1\n", "version"),
+    ("version: STSv1\nmode: strict\nmx: a.example\nmax_age: 1\n", "mode"),
+    ("version: STSv1\nmode: enforce\nmx: a.example\n", "max_age"),
+    ("version: STSv1\nmode: enforce\nmx: a.example\nmax_age: soon\n", "max_age"),
+    ("version: STSv1\nmode: testing\nmax_age: 1\n", "mx"),
+])
+def test_parse_policy_errors(text, error):
+    with pytest.raises(ValueError, match=error):
+        mta_sts.parse_policy(text)
+
+
+def test_parse_policy_mode_none_needs_no_mx():
+    assert mta_sts.parse_policy("version: STSv1\nmode: none\nmax_age: 1\n")["mx"] == []
+
+
+@pytest.mark.parametrize("pattern, host, expected", [
+    ("*.mail.example.com", "mx1.mail.example.com", True),
+    ("*.mail.example.com", "MX1.Mail.Example.com.", True),
+    ("*.mail.example.com", "a.b.mail.example.com", False),
+    ("*.mail.example.com", "mail.example.com", False),
+    ("mx1.example.com", "mx1.example.com.", True),
+    ("mx1.example.com", "mx2.example.com", False),
+])
+def test_mx_matches(pattern, host, expected):
+    assert mta_sts.mx_matches(pattern, host) is expected
+
+
+# ===============================================================
+# Fetch + cache
+# ===============================================================
+def test_fetch_and_cache_hit_on_same_id(server):
+    path = serve(server, "a.example")
+    policy, cached = mta_sts.get_policy("a.example", "id1")
+    assert (policy["mode"], cached) == ("enforce", False)
+    assert policy["mx"] == ["mx1.example.com", "*.mail.example.com"]
+    _, cached = mta_sts.get_policy("a.example", "id1")
+    assert cached is True
+    assert server.hits[path] == 1
+
+
+def test_refetch_when_id_changes(server):
+    path = serve(server, "b.example")
+    mta_sts.get_policy("b.example", "id1")
+    _, cached = mta_sts.get_policy("b.example", "id2")
+    assert cached is False
+    assert server.hits[path] == 2
+
+
+def test_refetch_after_max_age(server, monkeypatch):
+    path = serve(server, "c.example", POLICY.replace("86400", "60"))
+    mta_sts.get_policy("c.example", "id1")
+
+    class Later:
+        @staticmethod
+        def monotonic():
+            return time.monotonic() + 61
+
+    monkeypatch.setattr(mta_sts, "time", Later)
+    _, cached = mta_sts.get_policy("c.example", "id1")
+    assert cached is False
+    assert server.hits[path] == 2
+
+
+def test_redirect_is_refused(server):
+    target = serve(server, "elsewhere.example")
+    serve(server, "d.example", "", status=301, Location=target)
+    with pytest.raises(ValueError, match="HTTP 301"):
+        mta_sts.get_policy("d.example", "id1")
+    assert target not in server.hits
+
+
+def test_oversized_policy_is_refused(server):
+    serve(server, "e.example", POLICY + "#" * mta_sts.POLICY_MAX_BYTES)
+    with pytest.raises(ValueError, match="too large"):
+        mta_sts.get_policy("e.example", "id1")
+
+
+def test_wrong_content_type_is_refused(server):
+    serve(server, "f.example", ctype="text/html")
+    with pytest.raises(ValueError, match="Content-Type"):
+        mta_sts.get_policy("f.example", "id1")
+    assert mta_sts.policy_cache.get("f.example", "id1") is None
+
+
+# ===============================================================
+# Deadline
+# ===============================================================
+def test_slow_body_stops_at_deadline(server):
+    path = serve(server, "g.example")
+    server.drip[path] = 0.05  # ~5 s for the whole policy, each read well under the read timeout
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        mta_sts.get_policy("g.example", "id1", deadline=started + 0.5)
+    assert time.monotonic() - started < 1.5
+
+
+def test_stuck_name_lookup_stops_at_deadline(server, monkeypatch):
+    real = socket.getaddrinfo
+
+    def slow_getaddrinfo(*args, **kwargs):
+        time.sleep(2)
+        return real(*args, **kwargs)
+
+    monkeypatch.setattr(socket, "getaddrinfo", slow_getaddrinfo)
+    serve(server, "h.example")
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        mta_sts.get_policy("h.example", "id1", deadline=started + 0.3)
+    assert time.monotonic() - started < 1.0
+    assert mta_sts.policy_cache.get("h.example", "id1") is None
+
+
+def test_fetch_within_deadline(server):
+    serve(server, "i.example")
+    policy, cached = mta_sts.get_policy("i.example", "id1", deadline=time.monotonic() + 5)
+    assert (policy["mode"], cached) == ("enforce", False)
@@ -0,0 +1,112 @@
+# ===============================================================
+# tests/test_queue_logging.py — Non-blocking logging pieces
+# Description: Drop-and-count, sampling, rate parsing and the
+#              "records dropped" note, exercised without the writer thread.
+# Usage: python -m pytest -q tests
+# ===============================================================
+
+from __future__ import annotations
+import logging, queue, sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import queue_logging
+from queue_logging import (
+    DroppingQueueHandler, SamplingFilter, StructuredFormatter, _ReportingListener, parse_sample_rates,
+)
+
+
+def record(msg="hello", **extra) -> logging.LogRecord:
+    return logging.makeLogRecord({"name": "t", "levelno": logging.INFO, "levelname": "INFO", "msg": msg, **extra})
+
+
+class Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, rec):
+        self.records.append(rec)
+
+
+# ===============================================================
+# DroppingQueueHandler
+# ===============================================================
+def test_full_queue_drops_and_counts():
+    h = DroppingQueueHandler(queue.Queue(maxsize=2))
+    for i in range(5):
+        h.handle(record(f"m{i}"))
+    assert h.queue.qsize() == 2
+    assert h.dropped == 3
+    assert [h.queue.get_nowait().msg for _ in range(2)] == ["m0", "m1"]
+
+
+def test_prepare_defers_formatting_but_renders_tracebacks():
+    h = DroppingQueueHandler(queue.Queue())
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        rec = record("value %s", args=(1,), exc_info=sys.exc_info())
+    out = h.prepare(rec)
+    assert (out.msg, out.args) == ("value %s", (1,))
+    assert out.exc_info is None
+    assert "ValueError: boom" in out.exc_text
+
+
+# ===============================================================
+# SamplingFilter / parse_sample_rates
+# ===============================================================
+def test_sampling_rates(monkeypatch):
+    f = SamplingFilter({"never": 0.0, "always": 1.0, "half": 0.5})
+    assert f.filter(record()) is True                       # untagged
+    assert f.filter(record(sample="unknown")) is True       # no rate configured
+    assert f.filter(record(sample="always")) is True
+    assert f.filter(record(sample="never")) is False
+    monkeypatch.setattr(queue_logging.random, "random", lambda: 0.49)
+    assert f.filter(record(sample="half")) is True
+    monkeypatch.setattr(queue_logging.random, "random", lambda: 0.51)
+    assert f.filter(record(sample="half")) is False
+
+
+@pytest.mark.parametrize("spec, expected", [
+    (None, {}),
+    ("", {}),
+    ("request=0.1, geoip_error=0.5", {"request": 0.1, "geoip_error": 0.5}),
+    ("a=2,b=-1", {"a": 1.0, "b": 0.0}),                  # clamped to [0, 1]
+    ("a=x,b,=,c=0.3", {"c": 0.3}),                       # bad items ignored
+])
+def test_parse_sample_rates(spec, expected):
+    assert parse_sample_rates(spec) == expected
+
+
+def test_structured_formatter_appends_fields():
+    line = StructuredFormatter("%(message)s").format(record("hit", fields={"ip": "1.2.3.4", "cn": False}))
+    assert line == "hit ip=1.2.3.4 cn=False"
+
+
+# ===============================================================
+# _ReportingListener
+# ===============================================================
+def test_dropped_note_is_reported_once():
+    q: queue.Queue = queue.Queue(maxsize=1)
+    source = DroppingQueueHandler(q)
+    out = Capture()
+    listener = _ReportingListener(q, source, out)  # not started: handle() called directly
+
+    source.dropped = 3
+    listener.handle(record("first"))
+    listener.handle(record("second"))
+    source.dropped = 5
+    listener.handle(record("third"))
+
+    msgs = [(r.msg, getattr(r, "fields", None)) for r in out.records]
+    assert msgs == [
+        ("log queue full, records dropped", {"dropped": 3, "total": 3}),
+        ("first", None),
+        ("second", None),
+        ("log queue full, records dropped", {"dropped": 2, "total": 5}),
+        ("third", None),
+    ]
+    assert out.records[0].levelno == logging.WARNING